@@ -0,0 +1,115 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from api.metrics import get_store
+from api.versions import get_version
+
+TOKEN_KEY = 'auth:token:{key}'
+
+
+def auth_namespace(user_id):
+    """Версия данных входа пользователя: токены, пароль, активность."""
+    return f'auth:{user_id}'
+
+
+class TokenCache:
+    """
+    LRU-кэш токенов в памяти процесса: не больше size записей,
+    каждая живёт timeout секунд.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (
+                time.monotonic() + settings.AUTH_TOKEN_CACHE_TIMEOUT, value
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к БД на каждый вызов API.
+    Токен и пользователь без хеша пароля (он загружается из БД только
+    при обращении) хранятся в памяти процесса и, если задан
+    AUTH_TOKEN_CACHE_ALIAS, в общем кэше вместе с версией данных входа
+    пользователя. Сигналы меняют версию при выходе (удалении токена),
+    смене пароля, деактивации и любом другом сохранении пользователя,
+    и записи с прежней версией сразу перестают использоваться.
+    """
+
+    def get_token(self, key):
+        model = self.get_model()
+        try:
+            token = model.objects.select_related('user').defer(
+                'user__password'
+            ).get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return token
+
+    def copy_credentials(self, token):
+        # Запрос получает копии, чтобы изменения пользователя в нём
+        # (например, загруженный пароль) не попали в кэш.
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
+
+    def authenticate_credentials(self, key):
+        cache_key = TOKEN_KEY.format(key=key)
+        result = 'local'
+        entry = token_cache.get(cache_key)
+        if entry is None and settings.AUTH_TOKEN_CACHE_ALIAS:
+            result = 'shared'
+            entry = caches[settings.AUTH_TOKEN_CACHE_ALIAS].get(cache_key)
+        if entry is not None:
+            token, version = entry
+            if version == get_version(auth_namespace(token.user_id)):
+                get_store().increment('auth_token_cache_total', (result,))
+                if result == 'shared':
+                    token_cache.set(cache_key, entry)
+                return self.copy_credentials(token)
+        get_store().increment('auth_token_cache_total', ('miss',))
+        token = self.get_token(key)
+        entry = (token, get_version(auth_namespace(token.user_id)))
+        token_cache.set(cache_key, entry)
+        if settings.AUTH_TOKEN_CACHE_ALIAS:
+            caches[settings.AUTH_TOKEN_CACHE_ALIAS].set(
+                cache_key, entry, settings.AUTH_TOKEN_CACHE_TIMEOUT
+            )
+        return self.copy_credentials(token)
@@ -0,0 +1,188 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from api.metrics import get_store
+from api.versions import get_version, get_versions, user_namespace
+
+
+def response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def record(result):
+    """Попадание или промах кэша ответов в метриках всех процессов."""
+    get_store().increment('response_cache_requests_total', (result,))
+
+
+def normalize_params(query_params):
+    """
+    Приводит параметры запроса к одному виду: сортирует ключи
+    и значения, убирает пустые значения и page=1.
+    """
+    params = []
+    for key in sorted(query_params):
+        for value in sorted(query_params.getlist(key)):
+            if value == '' or (key == 'page' and value == '1'):
+                continue
+            params.append((key, value))
+    return urlencode(params)
+
+
+class AnonymousCacheMixin:
+    """
+    Кэширует ответы list и retrieve для неавторизованных пользователей.
+    Ключ строится из версии набора данных cache_namespace, действия,
+    id объекта и нормализованных параметров запроса. При изменении
+    данных версия увеличивается сигналами, и старые ключи просто
+    перестают использоваться, без поиска и удаления.
+    """
+
+    cache_namespace = None
+
+    def get_cache_key(self, request):
+        params = hashlib.md5(
+            f'{request.scheme}://{request.get_host()}?'
+            f'{normalize_params(request.query_params)}'.encode()
+        ).hexdigest()
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        return (
+            f'response:{self.cache_namespace}:'
+            f'{get_version(self.cache_namespace)}:'
+            f'{self.action}:{lookup or ""}:{params}'
+        )
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        cache = response_cache()
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            record('hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        record('misses')
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class ConditionalGetMixin:
+    """
+    Ответ 304 на list и retrieve по If-None-Match и If-Modified-Since
+    до кэша ответов и сериализаторов. ETag и Last-Modified строятся
+    из версий наборов данных conditional_namespaces, версии данных
+    пользователя (флаги избранного, покупок и подписок) и параметров
+    запроса, для объекта к ним добавляется get_object_state.
+    Если задан conditional_max_age, ETag списков и ответов
+    неавторизованным меняется не реже раза в conditional_max_age секунд:
+    счётчики в них меняются без смены версии и, как в кэше ответов,
+    отстают не дольше этого времени.
+    """
+
+    conditional_namespaces = ()
+    conditional_max_age = None
+    conditional_object = None
+
+    def get_conditional_namespaces(self):
+        return self.conditional_namespaces
+
+    def get_object_state(self, instance=None):
+        """
+        Версия и время изменения объекта instance, а без него - объекта
+        из URL одним лёгким запросом. None, если объекта нет.
+        """
+        return '', 0
+
+    def get_object(self):
+        self.conditional_object = super().get_object()
+        return self.conditional_object
+
+    def get_validators(self, request, versions, modified, state):
+        versions, modified = [*versions, state[0]], [*modified, state[1]]
+        if self.conditional_max_age and (
+            self.action != 'retrieve' or not request.user.is_authenticated
+        ):
+            period = int(time.time() // self.conditional_max_age)
+            versions.append(period)
+            modified.append(period * self.conditional_max_age)
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        etag = hashlib.md5(
+            f'{self.action}:{lookup or ""}:{versions}:'
+            f'{request.scheme}://{request.get_host()}:'
+            f'{request.META.get("HTTP_ACCEPT", "")}:'
+            f'{normalize_params(request.query_params)}'.encode()
+        ).hexdigest()
+        return quote_etag(etag), int(max(modified))
+
+    def conditional_response(self, view, request, *args, **kwargs):
+        namespaces = list(self.get_conditional_namespaces())
+        if request.user.is_authenticated:
+            namespaces.append(user_namespace(request.user.pk))
+        versions, modified = get_versions(*namespaces)
+        validators = None
+        # Без условных заголовков состояние объекта берётся из самого
+        # ответа, чтобы не делать лишний запрос.
+        if self.action != 'retrieve' or (
+            {'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE'}
+            & request.META.keys()
+        ):
+            state = (
+                self.get_object_state() if self.action == 'retrieve'
+                else ('', 0)
+            )
+            if state is None:
+                return view(request, *args, **kwargs)
+            validators = self.get_validators(
+                request, versions, modified, state
+            )
+            response = get_conditional_response(
+                request, etag=validators[0], last_modified=validators[1]
+            )
+            if response is not None:
+                return self.set_validators(response, validators)
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if validators is None:
+            state = self.get_object_state(self.conditional_object)
+            if state is None:
+                return response
+            validators = self.get_validators(
+                request, versions, modified, state
+            )
+        return self.set_validators(response, validators)
+
+    def set_validators(self, response, validators):
+        response['ETag'] = validators[0]
+        response['Last-Modified'] = http_date(validators[1])
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
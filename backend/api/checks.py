@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+@register()
+def check_version_cache(app_configs, **kwargs):
+    """
+    Версии данных должны быть общими для всех процессов: иначе запись
+    в одном воркере gunicorn или в команде manage.py не сбросит кэши,
+    ETag, токены и индекс ингредиентов в остальных процессах.
+    """
+    cache = caches[settings.VERSION_CACHE_ALIAS]
+    if not isinstance(cache, (LocMemCache, DummyCache)):
+        return []
+    return [Error(
+        f'Кэш версий {settings.VERSION_CACHE_ALIAS} '
+        f'({type(cache).__name__}) не общий для процессов.',
+        hint=(
+            'Укажите в CACHE_BACKEND общий кэш, например '
+            'django.core.cache.backends.filebased.FileBasedCache или Redis.'
+        ),
+        id='api.E001',
+    )]
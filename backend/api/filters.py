@@ -1,34 +1,20 @@
 from django_filters.rest_framework import filters, FilterSet
 from rest_framework.exceptions import AuthenticationFailed
 
-from recipes.models import Ingredient, Recipe, Tag
-
-
-class FilterForIngredients(FilterSet):
-    """
-    Фильтрация для ингредиентов по имени(name) от набранных букв, например:
-    вводишь буквы "бал" выдаёт все слова из БД - балык, бальзам.
-    """
-
-    name = filters.CharFilter(field_name='name', method='filter_ingredient')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
-
-    def filter_ingredient(self, queryset, name, value):
-        return queryset.filter(
-            name__istartswith=value
-        )
+from recipes.models import Recipe, Tag
 
 
 class FilterForRecipes(FilterSet):
     """
-    Фильтрация для рецепта по тегу, покупкам и избарнном с 2 методами:
+    Фильтрация для рецепта по тегу, покупкам и избарнном с 4 методами:
     1) filter_favorited - если в избранном есть рецепт,
     то пользователю сделавший запрос вернёт данный рецепт.
     2) filter_shopping_cart - если в покупках есть рецепт,
     то пользователю сделавший запрос вернёт данный рецепт.
+    3) filter_search - поиск по названию и описанию рецепта,
+    самые подходящие рецепты выдаются первыми.
+    4) filter_ordering - сортировка по популярности или дате
+    (например, ordering=-favorites_count), при равенстве - новые первыми.
     """
 
     tags = filters.ModelMultipleChoiceFilter(
@@ -42,10 +28,18 @@ class FilterForRecipes(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         field_name='is_in_shopping_cart', method='filter_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.OrderingFilter(
+        fields=('favorites_count', 'in_carts_count', 'pub_date'),
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search',
+            'ordering',
+        )
 
     def filter_favorited(self, queryset, name, value):
         if self.request.user.is_anonymous:
@@ -64,3 +58,9 @@ class FilterForRecipes(FilterSet):
         if value:
             return queryset.filter(shopping__user=self.request.user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return queryset.search(value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*value, '-pub_date', '-id')
@@ -0,0 +1,93 @@
+import threading
+from bisect import bisect_left
+
+from api.versions import get_version
+from recipes.models import Ingredient
+
+EXACT, PREFIX, WORD_START, SUBSTRING = range(4)
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+    Названия хранятся отсортированными, поэтому поиск по началу
+    названия или по началу любого слова - бинарный поиск.
+    Результаты поиска ранжируются: точное совпадение, начало названия,
+    начало слова, затем вхождение подстроки в любом месте.
+    """
+
+    def __init__(self, ingredients):
+        self.items = sorted(
+            (
+                {
+                    'id': ingredient_id,
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                }
+                for ingredient_id, name, measurement_unit in ingredients
+            ),
+            key=lambda item: (item['name'].lower(), item['id'])
+        )
+        self.names = [item['name'].lower() for item in self.items]
+        self.words = sorted(
+            (name[start:], position)
+            for position, name in enumerate(self.names)
+            for start in range(1, len(name))
+            if not name[start - 1].isalnum() and name[start].isalnum()
+        )
+        self.word_keys = [word for word, _ in self.words]
+
+    def prefix_range(self, keys, value):
+        start = bisect_left(keys, value)
+        end = start
+        while end < len(keys) and keys[end].startswith(value):
+            end += 1
+        return start, end
+
+    def search(self, value, limit=None):
+        """
+        Не больше limit ингредиентов, подходящих под value; для пустого
+        value - первые по алфавиту.
+        """
+        value = value.lower()
+        if not value:
+            return self.items[:limit]
+        ranks = {}
+        start, end = self.prefix_range(self.names, value)
+        for position in range(start, end):
+            name = self.names[position]
+            ranks[position] = EXACT if name == value else PREFIX
+        start, end = self.prefix_range(self.word_keys, value)
+        for _, position in self.words[start:end]:
+            ranks.setdefault(position, WORD_START)
+        for position, name in enumerate(self.names):
+            if position not in ranks and value in name:
+                ranks[position] = SUBSTRING
+        return [
+            self.items[position]
+            for position in sorted(
+                ranks, key=lambda position: (ranks[position], position)
+            )[:limit]
+        ]
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    """
+    Возвращает индекс ингредиентов текущего процесса и перестраивает его,
+    если версия ingredients изменилась после записи в таблицу.
+    """
+    global _index, _index_version
+    version = get_version('ingredients')
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = IngredientIndex(Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ))
+                _index_version = version
+    return _index
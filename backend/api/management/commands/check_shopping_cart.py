@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет, что сводный список покупок совпадает '
+        'с рецептами в корзинах пользователей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='id пользователя, можно указать несколько раз'
+        )
+
+    def handle(self, *args, **options):
+        errors = ShoppingCartIngredient.objects.inconsistencies(
+            options['users']
+        )
+        for (user_id, ingredient_id), amounts in sorted(errors.items()):
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'ожидается {amounts["expected"]}, '
+                f'в таблице {amounts["actual"]}'
+            )
+        if errors:
+            raise CommandError(
+                f'Найдено расхождений: {len(errors)}. '
+                'Запустите rebuild_shopping_cart.'
+            )
+        self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
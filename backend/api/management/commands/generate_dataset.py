@@ -0,0 +1,394 @@
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from api.versions import bump_version
+from recipes.models import (
+    Favourite, FeedEntry, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingCartIngredient, Tag
+)
+from users.models import Subscription, User, count_by
+
+WORDS = (
+    'нарезать', 'смешать', 'добавить', 'обжарить', 'посолить', 'варить',
+    'запекать', 'минут', 'на', 'среднем', 'огне', 'до', 'готовности',
+    'подавать', 'с', 'зеленью', 'тесто', 'соус', 'овощи', 'аккуратно',
+)
+
+# Общие для процессов данные: заполняются до запуска пула и достаются
+# процессам через fork без передачи по каналу.
+DATASET = {}
+
+
+class ZipfSampler:
+    """
+    Выбор элементов с вероятностью 1 / rank ** exponent: немногие
+    популярные элементы выбираются часто, большинство - редко.
+    Порядок популярности перемешивается генератором с seed.
+    """
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(itertools.accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)
+        ))
+
+    def choice(self, rng):
+        position = bisect_left(
+            self.cum_weights, rng.random() * self.cum_weights[-1]
+        )
+        return self.items[min(position, len(self.items) - 1)]
+
+    def sample(self, rng, size, exclude=None):
+        size = min(size, len(self.items) - (exclude is not None))
+        chosen = set()
+        while len(chosen) < size:
+            item = self.choice(rng)
+            if item != exclude:
+                chosen.add(item)
+        return chosen
+
+
+def chunk_rng(kind, start):
+    return random.Random(f'{DATASET["seed"]}:{kind}:{start}')
+
+
+def recipe_links(start, stop):
+    rng = chunk_rng('recipes', start)
+    options = DATASET['options']
+    ingredients, tags = [], []
+    for recipe_id in DATASET['recipes'][start:stop]:
+        size = rng.randint(
+            options['min_ingredients'], options['max_ingredients']
+        )
+        for ingredient_id in DATASET['ingredients'].sample(rng, size):
+            ingredients.append(
+                (recipe_id, ingredient_id, rng.choice(DATASET['amounts']))
+            )
+        for tag_id in DATASET['tags'].sample(rng, rng.randint(1, 3)):
+            tags.append((recipe_id, tag_id))
+    return [
+        (IngredientRecipe, ('recipes_id', 'ingredients_id', 'amount'),
+         ingredients),
+        (Recipe.tags.through, ('recipe_id', 'tag_id'), tags),
+    ]
+
+
+def user_links(start, stop):
+    rng = chunk_rng('users', start)
+    options = DATASET['options']
+    favorites, carts, subscriptions = [], [], []
+    for user_id in DATASET['users'][start:stop]:
+        for rows, mean, sampler, exclude in (
+            (favorites, options['favorites'], DATASET['recipe_sampler'], None),
+            (carts, options['carts'], DATASET['recipe_sampler'], None),
+            (subscriptions, options['subscriptions'],
+             DATASET['author_sampler'], user_id),
+        ):
+            size = int(rng.expovariate(1 / mean)) if mean else 0
+            rows.extend(
+                (user_id, item_id)
+                for item_id in sampler.sample(rng, size, exclude)
+            )
+    return [
+        (Favourite, ('user_id', 'recipes_id'), favorites),
+        (ShoppingCart, ('user_id', 'recipes_id'), carts),
+        (Subscription, ('user_id', 'author_id'), subscriptions),
+    ]
+
+
+def write_rows(model, fields, rows, use_copy, batch_size):
+    if use_copy:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        columns = ', '.join(
+            model._meta.get_field(field).column for field in fields
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {model._meta.db_table} ({columns}) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+        return
+    model.objects.bulk_create(
+        (model(**dict(zip(fields, row))) for row in rows),
+        batch_size=batch_size
+    )
+
+
+def write_chunk(task):
+    """Создаёт и записывает связи для части рецептов или пользователей."""
+    kind, start, stop = task
+    options = DATASET['options']
+    generate = recipe_links if kind == 'recipes' else user_links
+    written = 0
+    for model, fields, rows in generate(start, stop):
+        write_rows(
+            model, fields, rows, options['copy'], options['batch_size']
+        )
+        written += len(rows)
+    if kind == 'users' and options['feed']:
+        for user_id in DATASET['users'][start:stop]:
+            FeedEntry.objects.subscribe(
+                user_id, Subscription.objects.filter(
+                    user=user_id
+                ).values_list('author', flat=True)
+            )
+    return stop - start, written
+
+
+def close_connections():
+    # Соединение родительского процесса нельзя использовать после fork.
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет БД синтетическими пользователями, рецептами, '
+        'избранным, покупками и подписками для замеров производительности. '
+        'Одинаковый --seed даёт одинаковый набор данных.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--min-ingredients', type=int, default=3)
+        parser.add_argument('--max-ingredients', type=int, default=12)
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее количество рецептов в избранном пользователя'
+        )
+        parser.add_argument(
+            '--carts', type=float, default=5,
+            help='Среднее количество рецептов в списке покупок пользователя'
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=10,
+            help='Среднее количество подписок пользователя'
+        )
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Показатель распределения Ципфа для популярности'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределить даты публикации'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--prefix', default='gen',
+            help='Префикс юзернеймов и названий, должен быть новым '
+                 'для каждого запуска на одной БД'
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Количество процессов для записи связей'
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Записывать связи через COPY (PostgreSQL)'
+        )
+        parser.add_argument(
+            '--feed', action='store_true',
+            help='Заполнить ленты подписок'
+        )
+
+    def handle(self, *args, **options):
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy работает только с PostgreSQL.')
+        if options['min_ingredients'] > options['max_ingredients']:
+            raise CommandError(
+                '--min-ingredients больше, чем --max-ingredients.'
+            )
+        if connection.vendor == 'sqlite':
+            # SQLite не умеет писать из нескольких процессов одновременно.
+            options['workers'] = 1
+        if not Ingredient.objects.exists():
+            raise CommandError(
+                'Нет ингредиентов, сначала запустите unpack_ingredients.'
+            )
+        rng = random.Random(options['seed'])
+        DATASET.update(seed=options['seed'], options=options)
+        self.started = time.monotonic()
+
+        tags = self.create_tags(rng, options)
+        users = self.create_users(options)
+        user_sampler = ZipfSampler(users, options['zipf'], rng)
+        recipes = self.create_recipes(rng, options, user_sampler)
+        DATASET.update(
+            users=users,
+            recipes=recipes,
+            tags=ZipfSampler(tags, options['zipf'], rng),
+            ingredients=ZipfSampler(
+                Ingredient.objects.values_list('pk', flat=True),
+                options['zipf'], rng
+            ),
+            amounts=(1, 2, 3, 5, 10, 50, 100, 150, 200, 250, 300, 500),
+            recipe_sampler=ZipfSampler(recipes, options['zipf'], rng),
+            author_sampler=user_sampler,
+        )
+        self.run_chunks('recipes', len(recipes), options)
+        self.run_chunks('users', len(users), options)
+        self.update_totals(users, recipes)
+        bump_version('recipes')
+        self.report('Готово')
+
+    def report(self, message):
+        self.stdout.write(
+            f'{message} ({time.monotonic() - self.started:.1f} с)'
+        )
+
+    def create_tags(self, rng, options):
+        existing = list(Tag.objects.values_list('pk', flat=True))
+        missing = options['tags'] - len(existing)
+        if missing > 0:
+            colors = set(Tag.objects.values_list('color', flat=True))
+            new_colors = []
+            while len(new_colors) < missing:
+                color = f'#{rng.randrange(0x1000000):06X}'
+                if color not in colors:
+                    colors.add(color)
+                    new_colors.append(color)
+            last_id = Tag.objects.order_by('-pk').values_list(
+                'pk', flat=True
+            ).first() or 0
+            Tag.objects.bulk_create(
+                Tag(
+                    name=f'{options["prefix"]} тег {number}',
+                    color=color,
+                    slug=f'{options["prefix"]}-tag-{number}'
+                )
+                for number, color in enumerate(new_colors)
+            )
+            existing += list(Tag.objects.filter(pk__gt=last_id).order_by(
+                'pk'
+            ).values_list('pk', flat=True))
+        return existing
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        password = make_password(None)
+        last_id = User.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        User.objects.bulk_create(
+            (
+                User(
+                    email=f'{prefix}{number}@example.com',
+                    username=f'{prefix}{number}',
+                    first_name='Пользователь',
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(options['users'])
+            ),
+            batch_size=options['batch_size']
+        )
+        users = list(User.objects.filter(pk__gt=last_id).order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+        self.report(f'Пользователей: {len(users)}')
+        return users
+
+    def create_recipes(self, rng, options, authors):
+        last_id = Recipe.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=authors.choice(rng),
+                    name=f'{options["prefix"]} рецепт {number}',
+                    image='recipes/images/generated.png',
+                    text=' '.join(rng.choices(WORDS, k=rng.randint(20, 80))),
+                    cooking_time=rng.randint(5, 180),
+                )
+                for number in range(options['recipes'])
+            ),
+            batch_size=options['batch_size']
+        )
+        recipes = list(Recipe.objects.filter(pk__gt=last_id).order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+        self.spread_pub_dates(rng, options, recipes)
+        self.report(f'Рецептов: {len(recipes)}')
+        return recipes
+
+    def spread_pub_dates(self, rng, options, recipes):
+        """
+        bulk_create ставит всем рецептам одно время публикации,
+        поэтому даты распределяются за последние --days дней,
+        более поздние рецепты публикуются позже.
+        """
+        now = timezone.now()
+        period = options['days'] * 24 * 60 * 60
+        offsets = sorted(
+            (rng.uniform(0, period) for _ in recipes), reverse=True
+        )
+        Recipe.objects.bulk_update(
+            (
+                Recipe(pk=pk, pub_date=now - timedelta(seconds=offset))
+                for pk, offset in zip(recipes, offsets)
+            ),
+            ['pub_date'],
+            batch_size=options['batch_size']
+        )
+
+    def run_chunks(self, kind, total, options):
+        size = max(1, options['batch_size'] // 10)
+        tasks = [
+            (kind, start, min(start + size, total))
+            for start in range(0, total, size)
+        ]
+        done = written = 0
+        if options['workers'] > 1:
+            close_connections()
+            pool = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=close_connections
+            )
+            results = pool.map(write_chunk, tasks)
+        else:
+            pool = None
+            results = map(write_chunk, tasks)
+        try:
+            for chunk_done, chunk_written in results:
+                done += chunk_done
+                written += chunk_written
+                elapsed = time.monotonic() - self.started
+                self.stdout.write(
+                    f'{kind}: {done}/{total}, записано строк: {written}, '
+                    f'{written / elapsed:.0f} строк/с'
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def update_totals(self, users, recipes):
+        Recipe.objects.filter(pk__in=recipes).update(
+            favorites_count=count_by(Favourite, 'recipes'),
+            in_carts_count=count_by(ShoppingCart, 'recipes'),
+        )
+        User.objects.filter(pk__in=users).update(
+            followers_count=count_by(Subscription, 'author')
+        )
+        ShoppingCartIngredient.objects.rebuild(users)
+        self.report('Счётчики и списки покупок пересчитаны')
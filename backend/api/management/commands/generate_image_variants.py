@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_variants, save_variants, variants_outdated
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт уменьшенные копии и WebP для изображений рецептов '
+        'из recipes/images/, у которых их ещё нет'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.IMAGE_VARIANTS_WORKERS,
+            help='Количество процессов для обработки изображений'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать копии для всех изображений'
+        )
+
+    def handle(self, *args, **options):
+        recipes = [
+            (recipe_id, image)
+            for recipe_id, image, variants in Recipe.objects.exclude(
+                image=''
+            ).values_list('id', 'image', 'image_variants').iterator()
+            if options['force'] or variants_outdated(
+                Recipe(image=image, image_variants=variants)
+            )
+        ]
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [
+                (recipe_id, image, pool.submit(
+                    build_variants, str(settings.MEDIA_ROOT), recipe_id, image
+                ))
+                for recipe_id, image in recipes
+            ]
+            for recipe_id, image, future in futures:
+                try:
+                    save_variants(recipe_id, image, future.result())
+                    done += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'Рецепт {recipe_id}, {image}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {done}, с ошибками: {failed}.'
+        ))
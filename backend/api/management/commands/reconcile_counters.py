@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes.models import Favourite, Recipe, ShoppingCart
+from users.models import Subscription, User, count_by
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики рецептов (favorites_count, in_carts_count) '
+        'и подписчиков (followers_count) с таблицами и исправляет '
+        'расхождения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не исправляя'
+        )
+
+    def handle(self, *args, **options):
+        recipes = list(Recipe.objects.annotate(
+            actual_favorites=count_by(Favourite, 'recipes'),
+            actual_carts=count_by(ShoppingCart, 'recipes'),
+        ).exclude(
+            favorites_count=F('actual_favorites'),
+            in_carts_count=F('actual_carts'),
+        ).only('id', 'favorites_count', 'in_carts_count'))
+        for recipe in recipes:
+            self.stdout.write(
+                f'Рецепт {recipe.id}: избранное {recipe.favorites_count} '
+                f'-> {recipe.actual_favorites}, покупки '
+                f'{recipe.in_carts_count} -> {recipe.actual_carts}'
+            )
+            recipe.favorites_count = recipe.actual_favorites
+            recipe.in_carts_count = recipe.actual_carts
+        users = list(User.objects.annotate(
+            actual_followers=count_by(Subscription, 'author'),
+        ).exclude(
+            followers_count=F('actual_followers')
+        ).only('id', 'followers_count'))
+        for user in users:
+            self.stdout.write(
+                f'Пользователь {user.id}: подписчики '
+                f'{user.followers_count} -> {user.actual_followers}'
+            )
+            user.followers_count = user.actual_followers
+        if not options['dry_run']:
+            Recipe.objects.bulk_update(
+                recipes, ['favorites_count', 'in_carts_count'],
+                batch_size=BATCH_SIZE
+            )
+            User.objects.bulk_update(
+                users, ['followers_count'], batch_size=BATCH_SIZE
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Расхождений: рецепты - {len(recipes)}, '
+            f'пользователи - {len(users)}.'
+            + ('' if options['dry_run'] else ' Исправлено.')
+        ))
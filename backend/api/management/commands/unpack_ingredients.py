@@ -1,28 +1,210 @@
 import csv
+import io
+import json
 import os
+import time
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.versions import bump_version
 from recipes.models import Ingredient
 
+MAX_LENGTH = 200
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    """
+    Строки CSV как пары (name, measurement_unit): короткие и пустые
+    строки дополняются None, лишние столбцы отбрасываются.
+    """
+    for row in csv.reader(file):
+        if row[:2] == ['name', 'measurement_unit']:
+            continue
+        yield tuple(row[:2]) + (None,) * (2 - len(row[:2]))
+
+
+def read_json(file):
+    """
+    Читает массив JSON по частям, не загружая весь файл в память.
+    Элементы, которые не являются объектами, дают пару (None, None).
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and buffer[position:position + 1] == '[':
+                started = True
+                position += 1
+                continue
+            if buffer[position:position + 1] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            if isinstance(item, dict):
+                yield item.get('name'), item.get('measurement_unit')
+            else:
+                yield None, None
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise CommandError('Файл JSON обрывается на середине.')
+
+
+class CopyBuffer(io.RawIOBase):
+    """Файловый объект для COPY, который читает строки из генератора."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self.buffer) < len(target):
+            try:
+                name, measurement_unit = next(self.rows)
+            except StopIteration:
+                break
+            line = io.StringIO()
+            csv.writer(line).writerow((name, measurement_unit))
+            self.buffer += line.getvalue().encode('utf8')
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
 
 class Command(BaseCommand):
-    help = 'Импортирует данные в БД из папки static/data'
-
-    def handle(self, *args, **kwargs):
-
-        with open(
-            os.path.join(
-                os.path.join(settings.BASE_DIR, 'data'), 'ingredients.csv'
-            ),
-            'r',
-            newline='',
-            encoding='utf8'
-        ) as f:
-            reader = csv.reader(f)
-            next(reader)
-            for row in reader:
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
+    help = (
+        'Импортирует ингредиенты в БД из файла CSV или JSON '
+        '(по умолчанию data/ingredients.csv). Уже существующие '
+        'ингредиенты пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Путь к файлу CSV или JSON'
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество строк в одном INSERT'
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Загрузить через COPY во временную таблицу (PostgreSQL)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только прочитать и проверить файл, ничего не записывая'
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(
+            options['file']
+        )[1].lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Поддерживаются только файлы CSV и JSON.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy работает только с PostgreSQL.')
+        self.started = time.monotonic()
+        self.read = 0
+        self.skipped = 0
+        with open(options['file'], 'r', newline='', encoding='utf8') as f:
+            reader = read_csv(f) if file_format == 'csv' else read_json(f)
+            rows = self.clean(reader)
+            if options['dry_run']:
+                for _ in rows:
+                    pass
+                self.report('Проверено')
+                return
+            before = Ingredient.objects.count()
+            if options['copy']:
+                self.copy(rows)
+            else:
+                self.bulk_insert(rows, options['batch_size'])
+        created = Ingredient.objects.count() - before
+        bump_version('ingredients')
+        self.report('Прочитано')
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено ингредиентов: {created}.'
+        ))
+
+    def clean(self, reader):
+        """
+        Обрезает пробелы и пропускает строки без названия или единицы
+        измерения, с нестроковыми или слишком длинными значениями.
+        """
+        for name, measurement_unit in reader:
+            self.read += 1
+            name = name.strip() if isinstance(name, str) else ''
+            measurement_unit = (
+                measurement_unit.strip()
+                if isinstance(measurement_unit, str) else ''
+            )
+            if (
+                not name or not measurement_unit
+                or len(name) > MAX_LENGTH
+                or len(measurement_unit) > MAX_LENGTH
+            ):
+                self.skipped += 1
+                continue
+            yield name, measurement_unit
+
+    def report(self, action):
+        elapsed = time.monotonic() - self.started
+        speed = self.read / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{action} строк: {self.read}, пропущено с ошибками: '
+            f'{self.skipped}, {elapsed:.1f} с, {speed:.0f} строк/с'
+        )
+
+    def bulk_insert(self, rows, batch_size):
+        batch = []
+        for name, measurement_unit in rows:
+            batch.append(
+                Ingredient(name=name, measurement_unit=measurement_unit)
+            )
+            if len(batch) >= batch_size:
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+                self.report('Обработано')
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def copy(self, rows):
+        table = Ingredient._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                io.BufferedReader(CopyBuffer(rows), READ_CHUNK_SIZE)
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT ON CONSTRAINT unique_name_measurement_unit '
+                'DO NOTHING'
+            )
@@ -0,0 +1,248 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+PREFIX = 'foodgram'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REQUEST_LABELS = ('route', 'method')
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Время ответа на запрос',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'http_response_size_bytes': (
+        'Размер тела ответа',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+    ),
+    'db_queries_per_request': (
+        'Количество SQL-запросов за один запрос',
+        (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+    ),
+    'db_query_duration_seconds': (
+        'Суммарное время SQL-запросов за один запрос',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+}
+COUNTERS = {
+    'http_requests_total': (
+        'Количество запросов', ('route', 'method', 'status'),
+    ),
+    'auth_token_cache_total': (
+        'Проверки токенов: из памяти процесса, из общего кэша, из БД',
+        ('result',),
+    ),
+    'response_cache_requests_total': (
+        'Обращения к кэшу ответов: попадания и промахи', ('result',),
+    ),
+}
+
+
+class MetricsStore:
+    """
+    Метрики текущего процесса. Значения копятся в памяти и не чаще
+    раза в METRICS_FLUSH_INTERVAL секунд записываются в собственный файл
+    процесса в каталоге METRICS_DIR. Эндпоинт метрик складывает файлы
+    всех процессов, поэтому видны суммы по всем воркерам gunicorn.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # После fork у процесса свой файл и пустые значения,
+        # иначе метрики родителя посчитались бы дважды.
+        self.pid = os.getpid()
+        self.path = os.path.join(
+            self.directory, f'{self.pid}-{time.time_ns()}.json'
+        )
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.flushed = 0
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        values = self.histograms.get(key)
+        if values is None:
+            values = self.histograms[key] = [0] * (len(buckets) + 2)
+        position = bisect_left(buckets, value)
+        if position < len(buckets):
+            values[position] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def increment(self, name, labels):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            self.counters[name, labels] += 1
+
+    def record(self, route, method, status, duration, queries, sql_time,
+               size=None):
+        labels = (route, method)
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            self.counters[
+                ('http_requests_total', (route, method, str(status)))
+            ] += 1
+            self.observe('http_request_duration_seconds', labels, duration)
+            self.observe('db_queries_per_request', labels, queries)
+            self.observe('db_query_duration_seconds', labels, sql_time)
+            if size is not None:
+                self.observe('http_response_size_bytes', labels, size)
+        self.flush()
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.flushed = now
+            data = {
+                'counters': [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    [name, labels, values]
+                    for (name, labels), values in self.histograms.items()
+                ],
+            }
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(
+            dir=self.directory, suffix='.tmp'
+        )
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary, self.path)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    directory = settings.METRICS_DIR
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = MetricsStore(directory)
+            atexit.register(store.flush, force=True)
+    return store
+
+
+def collect(directory):
+    """Складывает метрики из файлов всех процессов."""
+    counters = defaultdict(int)
+    histograms = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data['counters']:
+            counters[name, tuple(labels)] += value
+        for name, labels, values in data['histograms']:
+            total = histograms.setdefault(
+                (name, tuple(labels)), [0] * len(values)
+            )
+            for position, value in enumerate(values):
+                total[position] += value
+    return counters, histograms
+
+
+def format_labels(names, values, **extra):
+    pairs = [*zip(names, values), *extra.items()]
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+                '\n', r'\n'
+            )
+        )
+        for name, value in pairs
+    ) + '}'
+
+
+def format_number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def render(counters, histograms):
+    """Текст метрик в формате Prometheus."""
+    lines = []
+    for name, (help_text, label_names) in COUNTERS.items():
+        lines += [
+            f'# HELP {PREFIX}_{name} {help_text}',
+            f'# TYPE {PREFIX}_{name} counter',
+        ]
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(
+                    f'{PREFIX}_{name}{format_labels(label_names, labels)} '
+                    f'{format_number(value)}'
+                )
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [
+            f'# HELP {PREFIX}_{name} {help_text}',
+            f'# TYPE {PREFIX}_{name} histogram',
+        ]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bucket, value in zip(buckets, values):
+                cumulative += value
+                lines.append(
+                    f'{PREFIX}_{name}_bucket'
+                    f'{format_labels(REQUEST_LABELS, labels, le=bucket)} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'{PREFIX}_{name}_bucket'
+                f'{format_labels(REQUEST_LABELS, labels, le="+Inf")} '
+                f'{values[-1]}'
+            )
+            lines += [
+                f'{PREFIX}_{name}_sum{format_labels(REQUEST_LABELS, labels)} '
+                f'{format_number(values[-2])}',
+                f'{PREFIX}_{name}_count'
+                f'{format_labels(REQUEST_LABELS, labels)} {values[-1]}',
+            ]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Метрики всех процессов для Prometheus. Доступны только с адресов
+    METRICS_ALLOWED_IPS или с токеном METRICS_TOKEN в заголовке
+    Authorization: Bearer, для остальных эндпоинта нет.
+    """
+    token = settings.METRICS_TOKEN
+    if not (
+        request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+        or token and request.headers.get('Authorization') == f'Bearer {token}'
+    ):
+        raise Http404
+    get_store().flush(force=True)
+    return HttpResponse(
+        render(*collect(settings.METRICS_DIR)), content_type=CONTENT_TYPE
+    )
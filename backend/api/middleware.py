@@ -0,0 +1,210 @@
+import cProfile
+import io
+import logging
+import pstats
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from api.metrics import get_store
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_STATS_LIMIT = 30
+
+
+class QueryCounter:
+    """
+    Обёртка execute_wrapper, считающая SQL-запросы и их время.
+    Запросы дольше SLOW_QUERY_THRESHOLD миллисекунд пишутся в журнал
+    медленных запросов без параметров.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold = settings.SLOW_QUERY_THRESHOLD / 1000
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if duration >= self.threshold:
+                logger.warning(
+                    'slow query %.1f ms %s %s: %s', duration * 1000,
+                    self.request.method, self.request.path, sql
+                )
+
+
+class MetricsMiddleware:
+    """
+    Записывает для каждого маршрута (например, recipes-list) и метода
+    время ответа, количество и время SQL-запросов и размер ответа.
+    У потоковых ответов размер неизвестен и не записывается.
+    Запросы дольше SLOW_REQUEST_THRESHOLD миллисекунд пишутся
+    в журнал медленных запросов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter(request)
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        get_store().record(
+            route=route,
+            method=request.method,
+            status=response.status_code,
+            duration=duration,
+            queries=queries.count,
+            sql_time=queries.duration,
+            size=None if response.streaming else len(response.content),
+        )
+        if duration * 1000 >= settings.SLOW_REQUEST_THRESHOLD:
+            logger.warning(
+                'slow request %.1f ms %s %s (%s): %s SQL queries, %.1f ms',
+                duration * 1000, request.method, request.path, route,
+                queries.count, queries.duration * 1000
+            )
+        return response
+
+
+class QueryLog:
+    """Обёртка execute_wrapper, сохраняющая SQL-запросы и их время."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': repr(params),
+                'duration_ms': round(
+                    (time.perf_counter() - started) * 1000, 3
+                ),
+            })
+
+    def repeated(self):
+        """
+        Повторяющиеся запросы: одинаковый текст SQL с разными
+        параметрами (признак N+1) и полные повторы с теми же параметрами.
+        """
+        similar = defaultdict(list)
+        for query in self.queries:
+            similar[query['sql']].append(query['duration_ms'])
+        exact = Counter(
+            (query['sql'], query['params']) for query in self.queries
+        )
+        return {
+            'similar': [
+                {
+                    'sql': sql,
+                    'count': len(durations),
+                    'duration_ms': round(sum(durations), 3),
+                }
+                for sql, durations in sorted(
+                    similar.items(), key=lambda item: -len(item[1])
+                )
+                if len(durations) > 1
+            ],
+            'duplicates': [
+                {'sql': sql, 'params': params, 'count': count}
+                for (sql, params), count in exact.most_common()
+                if count > 1
+            ],
+        }
+
+
+def profile_stats(profiler):
+    """Самые долгие функции и отдельно функции сериализаторов."""
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(PROFILE_STATS_LIMIT)
+    stats.print_stats('serializers', PROFILE_STATS_LIMIT)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запроса для персонала. Включается параметром
+    ?profile=1 или заголовком X-Profile: 1, значение cprofile
+    добавляет сводку cProfile. Вместо ответа возвращается JSON
+    со всеми SQL-запросами, их временем и повторами.
+    Для остальных пользователей флаг ничего не меняет.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.GET.get(PROFILE_PARAM) or request.headers.get(
+            PROFILE_HEADER
+        )
+        if not mode or not self.is_staff(request):
+            return self.get_response(request)
+        log = QueryLog()
+        profiler = cProfile.Profile() if mode == 'cprofile' else None
+        started = time.perf_counter()
+        with connection.execute_wrapper(log):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+                if response.streaming:
+                    size = sum(map(len, response.streaming_content))
+                else:
+                    size = len(response.content)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        duration = time.perf_counter() - started
+        return JsonResponse({
+            'path': request.get_full_path(),
+            'status_code': response.status_code,
+            'size': size,
+            'duration_ms': round(duration * 1000, 3),
+            'sql_duration_ms': round(
+                sum(query['duration_ms'] for query in log.queries), 3
+            ),
+            'query_count': len(log.queries),
+            'queries': log.queries,
+            **log.repeated(),
+            'profile': profile_stats(profiler) if profiler else None,
+        }, json_dumps_params={'ensure_ascii': False})
+
+    def is_staff(self, request):
+        # Токен API проверяется здесь же: аутентификация DRF
+        # выполняется только во view, после middleware.
+        if request.user.is_authenticated:
+            return request.user.is_staff
+        drf_request = Request(request)
+        for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            try:
+                result = authentication().authenticate(drf_request)
+            except AuthenticationFailed:
+                return False
+            if result is not None:
+                return result[0].is_staff
+        return False
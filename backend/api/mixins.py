@@ -0,0 +1,51 @@
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+class FastListMixin:
+    """
+    Быстрый путь для списков только для чтения, включается настройкой
+    FAST_LIST_RENDERING. Страница выбирается через values() и
+    превращается в словари функцией represent_rows без моделей
+    и сериализаторов, а FastJSONRenderer кодирует её через orjson.
+    Ответ совпадает с обычным list побайтно. Вью задаёт
+    get_fast_queryset, fast_list_values и represent_rows, по умолчанию
+    строки values() отдаются как есть.
+    """
+
+    fast_list_values = ()
+
+    def fast_list_enabled(self):
+        return settings.FAST_LIST_RENDERING
+
+    def use_fast_list(self, request):
+        return self.fast_list_enabled() and isinstance(
+            request.accepted_renderer, JSONRenderer
+        )
+
+    def get_fast_queryset(self):
+        return self.get_queryset()
+
+    def get_fast_list_values(self):
+        return self.fast_list_values
+
+    def represent_rows(self, rows):
+        return list(rows)
+
+    def fast_list(self, queryset, *extra_values):
+        queryset = queryset.values(
+            *self.get_fast_list_values(), *extra_values
+        )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            response = Response(self.represent_rows(list(queryset)))
+        else:
+            response = self.get_paginated_response(self.represent_rows(page))
+        response.fast_json = True
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list(request):
+            return super().list(request, *args, **kwargs)
+        return self.fast_list(self.filter_queryset(self.get_fast_queryset()))
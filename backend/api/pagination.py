@@ -1,7 +1,174 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+from api.cache import response_cache
+from api.versions import get_version
+
+COUNT_KEY = 'count:{namespace}:{version}:{signature}'
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator, который не считает COUNT(*) на каждый запрос:
+    1) Если задан namespace, количество кэшируется на
+    COUNT_CACHE_TIMEOUT секунд по подписи фильтров (SQL выборки id)
+    и версии набора данных, которая меняется при записи рецептов.
+    2) Для выборки без фильтров на PostgreSQL при достаточно большой
+    таблице берётся оценка pg_class.reltuples, тогда count_exact - False.
+    """
+
+    def __init__(self, object_list, per_page, namespace=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.namespace = namespace
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        approximate = self.approximate_count()
+        if approximate is not None:
+            self.count_exact = False
+            return approximate
+        if not hasattr(self.object_list, 'values'):
+            return super().count
+        # Аннотации и сортировка на количество не влияют,
+        # без них COUNT(*) заметно дешевле.
+        queryset = self.object_list.values('pk').order_by()
+        if self.namespace is None:
+            return queryset.count()
+        cache = response_cache()
+        key = self.get_count_key(queryset)
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+        return count
+
+    def get_count_key(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        signature = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+        return COUNT_KEY.format(
+            namespace=self.namespace,
+            version=get_version(self.namespace),
+            signature=signature,
+        )
+
+    def approximate_count(self):
+        threshold = settings.APPROXIMATE_COUNT_THRESHOLD
+        queryset = self.object_list
+        if (
+            not threshold
+            or not hasattr(queryset, 'query')
+            or queryset.query.has_filters()
+            or queryset.query.distinct
+        ):
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < threshold:
+            return None
+        return row[0]
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Постраничный вывод рецептов по курсору. Курсор DRF хранит значение
+    первого поля ordering (pub_date) и смещение среди рецептов с тем же
+    значением, id только задаёт их порядок.
+    Параметры из ordering_params задают свой порядок, который курсор
+    заменил бы на ordering, поэтому с ними вывод идёт по страницам.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+    ordering_params = ('search', 'ordering')
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """Постраничный вывод ленты подписок по курсору."""
+
+    ordering = ('-feed_pub_date', '-id')
+
+
+class SubscriptionCursorPagination(RecipeCursorPagination):
+    """Постраничный вывод подписок по курсору, новые подписки первыми."""
+
+    ordering = ('-subscription_id',)
+    ordering_params = ()
 
 
 class ModifiedPagination(PageNumberPagination):
+    """
+    Постраничный вывод по номеру страницы. Если в запросе есть параметр
+    cursor (можно пустой - первая страница), а у view задан
+    cursor_pagination_class, вывод идёт по курсору: без COUNT(*) и OFFSET,
+    поэтому любая страница стоит столько же, сколько первая. Запросы
+    с параметрами ordering_params курсора выводятся по страницам.
+    Количество считается через CachedCountPaginator с версией из
+    get_count_cache_namespace view, поле count_exact показывает,
+    точное ли оно.
+    """
 
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_paginator = None
+
+    def get_cursor_pagination_class(self, request, view):
+        cursor_pagination_class = getattr(
+            view, 'cursor_pagination_class', None
+        )
+        if (
+            cursor_pagination_class is None
+            or 'cursor' not in request.query_params
+            or any(
+                request.query_params.get(param)
+                for param in cursor_pagination_class.ordering_params
+            )
+        ):
+            return None
+        return cursor_pagination_class
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_pagination_class = self.get_cursor_pagination_class(
+            request, view
+        )
+        if cursor_pagination_class:
+            self.cursor_paginator = cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        namespace = None
+        if hasattr(view, 'get_count_cache_namespace'):
+            namespace = view.get_count_cache_namespace()
+        self.django_paginator_class = partial(
+            CachedCountPaginator, namespace=namespace
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        paginator = self.page.paginator
+        return Response(OrderedDict([
+            ('count', paginator.count),
+            ('count_exact', paginator.count_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
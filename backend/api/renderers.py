@@ -0,0 +1,210 @@
+import abc
+import csv
+import io
+import json
+from datetime import datetime as dt
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ShoppingListRenderer(abc.ABC, BaseRenderer):
+    """
+    Базовый рендерер списка покупок с 3 методами:
+    1) render - отдаёт ответы DRF (например, ошибки) в формате JSON
+    с заголовком Content-Type: application/json.
+    2) stream - генератор, который по частям отдаёт список покупок
+    из строк с полями name, measurement_unit и amount.
+    3) lines - части документа, задаётся в каждом формате.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+    def stream(self, user, rows):
+        buffer = []
+        size = 0
+        for line in self.lines(user, rows):
+            buffer.append(line)
+            size += len(line)
+            if size >= CHUNK_SIZE:
+                yield ''.join(buffer).encode(self.charset)
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer).encode(self.charset)
+
+    @abc.abstractmethod
+    def lines(self, user, rows):
+        """Строки документа для пользователя user."""
+
+
+class TxtShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в текстовом формате."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def lines(self, user, rows):
+        yield (
+            f'Список покупок для {user.username}\n'
+            f'\nДата покупки - {dt.today():%d.%m.%Y}\n'
+        )
+        for buy in rows:
+            yield (
+                f'\n{buy["name"]}'
+                f' {buy["amount"]}'
+                f' {buy["measurement_unit"]}'
+                '\n-----------------------------------------------'
+            )
+        yield (
+            '\n\nСпасибо, что пользуетесь нашим сайтом!'
+            ' Будем Ждать вас снова! =)'
+        )
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def lines(self, user, rows):
+        line = io.StringIO()
+        writer = csv.writer(line)
+        writer.writerow(('name', 'amount', 'measurement_unit'))
+        for buy in rows:
+            writer.writerow(
+                (buy['name'], buy['amount'], buy['measurement_unit'])
+            )
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+        yield line.getvalue()
+
+
+class JsonShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+
+    media_type = 'application/json'
+    format = 'json'
+
+    def lines(self, user, rows):
+        yield (
+            f'{{"username":{json.dumps(user.username, ensure_ascii=False)},'
+            f'"date":"{dt.today():%Y-%m-%d}","ingredients":['
+        )
+        separator = ''
+        for buy in rows:
+            yield separator + json.dumps(
+                {
+                    'name': buy['name'],
+                    'amount': buy['amount'],
+                    'measurement_unit': buy['measurement_unit'],
+                },
+                ensure_ascii=False,
+                separators=(',', ':')
+            )
+            separator = ','
+        yield ']}'
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    """
+    Список покупок в формате PDF. Таблица перекрёстных ссылок PDF
+    записывается в конце документа, поэтому документ собирается
+    в памяти постранично и отдаётся частями по CHUNK_SIZE.
+    """
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_size = 11
+    line_height = 16
+    margin = 50
+
+    def get_font(self):
+        if 'ShoppingListFont' in pdfmetrics.getRegisteredFontNames():
+            return 'ShoppingListFont'
+        try:
+            pdfmetrics.registerFont(
+                TTFont('ShoppingListFont', settings.SHOPPING_LIST_PDF_FONT)
+            )
+        except Exception:
+            return 'Helvetica'
+        return 'ShoppingListFont'
+
+    def stream(self, user, rows):
+        buffer = io.BytesIO()
+        font = self.get_font()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        top = A4[1] - self.margin
+
+        def new_page():
+            pdf.setFont(font, self.font_size)
+            return top
+
+        position = new_page()
+        for line in self.lines(user, rows):
+            if position < self.margin:
+                pdf.showPage()
+                position = new_page()
+            pdf.drawString(self.margin, position, line)
+            position -= self.line_height
+        pdf.save()
+        view = buffer.getbuffer()
+        for start in range(0, len(view), CHUNK_SIZE):
+            yield bytes(view[start:start + CHUNK_SIZE])
+
+    def lines(self, user, rows):
+        yield f'Список покупок для {user.username}'
+        yield f'Дата покупки - {dt.today():%d.%m.%Y}'
+        yield ''
+        for buy in rows:
+            yield (
+                f'{buy["name"]} {buy["amount"]} {buy["measurement_unit"]}'
+            )
+        yield ''
+        yield 'Спасибо, что пользуетесь нашим сайтом! Будем Ждать вас снова!'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer, который ответы быстрого пути (fast_json у ответа)
+    кодирует через orjson, если пакет установлен. Результат совпадает
+    с JSONRenderer побайтно: компактный JSON, UTF-8 без экранирования,
+    U+2028 и U+2029 экранированы. Остальные ответы и ответы с отступами
+    рендерит JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+        if (
+            orjson is None
+            or data is None
+            or not getattr(response, 'fast_json', False)
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context)
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data).replace(
+            b'\xe2\x80\xa8', b'\\u2028'
+        ).replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -1,23 +1,68 @@
+import hashlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.db.models import F
-from django.shortcuts import get_object_or_404
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import SerializerMethodField
 
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
-from users.models import User
+from api.cache import response_cache
+from api.versions import author_namespace, get_versions
+from recipes.models import (
+    Ingredient, IngredientRecipe, Recipe, ShoppingCartIngredient, Tag
+)
+from users.models import User, bulk_changes
+
+BATCH_MAX_SIZE = 100
+
+
+def file_url(name, request):
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
+def current_variants(image, variants):
+    """Варианты изображения, если они созданы для текущего image."""
+    if not image:
+        return {}
+    if variants.get('original') == image:
+        return variants
+    return {'original': image}
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии изображения рецепта, например:
+    {"original": ..., "thumbnail": ..., "medium_webp": ...}.
+    Пока копии не созданы, содержит только original.
+    """
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        return {
+            variant: file_url(name, request)
+            for variant, name in variants.items()
+        }
+
+    def get_attribute(self, instance):
+        return current_variants(instance.image.name, instance.image_variants)
 
 
 class OptionalRecipeSerializer(serializers.ModelSerializer):
     """Дополнительный сериализатор для рецептов."""
 
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class CustomUserSerializer(UserSerializer):
@@ -37,6 +82,8 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_authenticated:
             return user.subscriber.filter(author=obj).exists()
@@ -72,6 +119,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     ingredients = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     is_favorited = SerializerMethodField()
@@ -80,27 +128,179 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
+            'is_in_shopping_cart', 'name', 'image', 'image_variants', 'text',
+            'cooking_time', 'favorites_count', 'in_carts_count',
         )
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_ingredients(self, obj):
-        return obj.ingredients.values().annotate(
-            amount=F('ingredient_recipe__amount')
-        )
+        return [
+            {
+                'id': ingredient_recipe.ingredients.id,
+                'name': ingredient_recipe.ingredients.name,
+                'measurement_unit': (
+                    ingredient_recipe.ingredients.measurement_unit
+                ),
+                'amount': ingredient_recipe.amount,
+            }
+            for ingredient_recipe in obj.ingredient_recipe.all()
+        ]
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_authenticated:
             return user.shopping.filter(recipes=obj).exists()
         return False
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_authenticated:
             return user.favorited.filter(recipes=obj).exists()
         return False
 
 
+RECIPE_VALUES = (
+    'id', 'name', 'image', 'image_variants', 'text', 'cooking_time',
+    'favorites_count', 'in_carts_count', 'is_favorited',
+    'is_in_shopping_cart', 'author_is_subscribed', 'author_id',
+    'author__email', 'author__username', 'author__first_name',
+    'author__last_name',
+)
+
+
+def represent_recipes(rows, request):
+    """
+    То же, что RecipeSerializer(many=True).data, для строк
+    values(*RECIPE_VALUES) без моделей и вложенных сериализаторов.
+    Теги и ингредиенты страницы загружаются двумя запросами.
+    """
+    ids = [row['id'] for row in rows]
+    tags = defaultdict(list)
+    for tag in Tag.objects.filter(recipe__in=ids).values(
+        'id', 'name', 'color', 'slug', recipe_id=F('recipe')
+    ):
+        tags[tag.pop('recipe_id')].append(tag)
+    ingredients = defaultdict(list)
+    for ingredient in IngredientRecipe.objects.filter(
+        recipes__in=ids
+    ).values(
+        'recipes_id', 'amount', 'ingredients__id', 'ingredients__name',
+        'ingredients__measurement_unit'
+    ):
+        ingredients[ingredient['recipes_id']].append({
+            'id': ingredient['ingredients__id'],
+            'name': ingredient['ingredients__name'],
+            'measurement_unit': ingredient['ingredients__measurement_unit'],
+            'amount': ingredient['amount'],
+        })
+    return [
+        {
+            'id': row['id'],
+            'tags': tags[row['id']],
+            'author': {
+                'email': row['author__email'],
+                'id': row['author_id'],
+                'username': row['author__username'],
+                'first_name': row['author__first_name'],
+                'last_name': row['author__last_name'],
+                'is_subscribed': row['author_is_subscribed'],
+            },
+            'ingredients': ingredients[row['id']],
+            'is_favorited': row['is_favorited'],
+            'is_in_shopping_cart': row['is_in_shopping_cart'],
+            'name': row['name'],
+            'image': file_url(row['image'], request) if row['image'] else None,
+            'image_variants': {
+                variant: file_url(name, request)
+                for variant, name in current_variants(
+                    row['image'], row['image_variants']
+                ).items()
+            },
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+            'favorites_count': row['favorites_count'],
+            'in_carts_count': row['in_carts_count'],
+        }
+        for row in rows
+    ]
+
+
+RECIPE_ROW_VALUES = (
+    'id', 'updated_at', 'favorites_count', 'in_carts_count', 'is_favorited',
+    'is_in_shopping_cart', 'author_is_subscribed', 'author_id',
+)
+FRAGMENT_KEY = 'fragment:recipe:{id}:{updated_at}:{versions}:{host}'
+
+
+def cached_recipes(rows, request):
+    """
+    То же, что represent_recipes, для строк values(*RECIPE_ROW_VALUES).
+    Общая для всех часть рецепта берётся из кэша ответов одним
+    get_many по ключу из id, updated_at (сигналы меняют его и при записи
+    ингредиентов и тегов рецепта) и версий тегов, ингредиентов
+    и автора рецепта. Поверх неё кладутся флаги пользователя и счётчики
+    из строки страницы. Недостающие части собираются тремя запросами
+    и сохраняются на RECIPE_FRAGMENT_TIMEOUT секунд.
+    """
+    cache = response_cache()
+    authors = list({row['author_id'] for row in rows})
+    versions, _ = get_versions(
+        'tags', 'ingredients', *map(author_namespace, authors)
+    )
+    shared = ':'.join(map(str, versions[:2]))
+    author_versions = dict(zip(authors, versions[2:]))
+    host = hashlib.md5(
+        f'{request.scheme}://{request.get_host()}'.encode()
+    ).hexdigest()
+    keys = {
+        row['id']: FRAGMENT_KEY.format(
+            id=row['id'], updated_at=row['updated_at'].timestamp(),
+            versions=f'{shared}:{author_versions[row["author_id"]]}',
+            host=host,
+        )
+        for row in rows
+    }
+    cached = cache.get_many(keys.values())
+    fragments = {pk: cached.get(key) for pk, key in keys.items()}
+    missing = [pk for pk, fragment in fragments.items() if fragment is None]
+    if missing:
+        built = {
+            fragment['id']: fragment
+            for fragment in represent_recipes(
+                Recipe.objects.filter(pk__in=missing).with_user_flags(
+                    AnonymousUser()
+                ).values(*RECIPE_VALUES),
+                request
+            )
+        }
+        fragments.update(built)
+        cache.set_many(
+            {keys[pk]: fragment for pk, fragment in built.items()},
+            settings.RECIPE_FRAGMENT_TIMEOUT
+        )
+    recipes = []
+    for row in rows:
+        recipe = dict(fragments[row['id']])
+        recipe['author'] = dict(
+            recipe['author'], is_subscribed=row['author_is_subscribed']
+        )
+        for field in (
+            'is_favorited', 'is_in_shopping_cart', 'favorites_count',
+            'in_carts_count',
+        ):
+            recipe[field] = row[field]
+        recipes.append(recipe)
+    return recipes
+
+
 class IngredientForRecipeSerializer(serializers.ModelSerializer):
     """Связывающий сериализатор для создания ингридиентов в рецепте."""
 
@@ -115,7 +315,9 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создание или обновление рецепта с 2 методами:
     1) create - Для создания рецепта.
-    2) update - Для обновления рецепта
+    2) update - Для обновления рецепта, меняет только те ингредиенты,
+    которые добавили, удалили или у которых изменилось количество.
+    Оба метода выполняются в одной транзакции.
     """
 
     tags = serializers.PrimaryKeyRelatedField(
@@ -150,28 +352,31 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         return value
 
     def validate_ingredients(self, ingredients):
-        ingredient_id = Ingredient.objects.values_list('id', flat=True)
-        for ing in ingredients:
-            if ing['id'] not in ingredient_id:
-                raise ValidationError(
-                    'Такого ингредиента не существует!'
-                )
         if not ingredients:
             raise ValidationError(
                 'Нужно добавить ингредиенты!'
             )
-        ingredients_list = []
+        existing_ids = set(Ingredient.objects.filter(
+            id__in={product['id'] for product in ingredients}
+        ).values_list('id', flat=True))
+        added_ids = set()
+        errors = []
         for product in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=product['id'])
-            if ingredient in ingredients_list:
-                raise ValidationError(
-                    'Этот ингредиент добавлен!'
-                )
-            elif 'amount' not in product:
-                raise ValidationError({
-                    'amount': 'обязательное поле!'
-                })
-            ingredients_list.append(ingredient)
+            product_errors = {}
+            if product['id'] not in existing_ids:
+                product_errors['id'] = [
+                    f'Ингредиента с id={product["id"]} не существует!'
+                ]
+            elif product['id'] in added_ids:
+                product_errors['id'] = [
+                    f'Ингредиент с id={product["id"]} уже добавлен!'
+                ]
+            if 'amount' not in product:
+                product_errors['amount'] = ['Обязательное поле!']
+            added_ids.add(product['id'])
+            errors.append(product_errors)
+        if any(errors):
+            raise ValidationError(errors)
         return ingredients
 
     def validate_image(self, image):
@@ -187,6 +392,10 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         return cooking_time
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         serializer = RecipeSerializer(
             instance,
             context={
@@ -195,6 +404,7 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         )
         return serializer.data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -202,26 +412,67 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             **validated_data,
             author=self.context.get('request').user,
         )
-        recipe.tags.set(tags)
-        for ingredient in ingredients:
-            IngredientRecipe.objects.create(
+        with bulk_changes():
+            recipe.tags.set(tags)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
                 ingredients_id=ingredient.get('id'),
                 amount=ingredient.get('amount'),
-                recipes=recipe)
+                recipes=recipe
+            )
+            for ingredient in ingredients
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
-        recipe.tags.clear()
-        recipe.ingredients.clear()
         tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        recipe.tags.set(tags)
-        for ingredient in ingredients:
-            IngredientRecipe.objects.create(
-                ingredients_id=ingredient.get('id'),
-                amount=ingredient.get('amount'),
+        new_amounts = {
+            ingredient.get('id'): ingredient.get('amount')
+            for ingredient in validated_data.pop('ingredients')
+        }
+        existing = {
+            ingredient_recipe.ingredients_id: ingredient_recipe
+            for ingredient_recipe in IngredientRecipe.objects.filter(
                 recipes=recipe
+            ).select_for_update()
+        }
+        old_amounts = {
+            ingredient_id: ingredient_recipe.amount
+            for ingredient_id, ingredient_recipe in existing.items()
+        }
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            # Сводные списки покупок меняются ниже одним вызовом
+            # change_recipe на все ингредиенты.
+            with bulk_changes():
+                IngredientRecipe.objects.filter(
+                    recipes=recipe, ingredients__in=removed
+                ).delete()
+        changed = []
+        for ingredient_id, ingredient_recipe in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != ingredient_recipe.amount:
+                ingredient_recipe.amount = amount
+                changed.append(ingredient_recipe)
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        added = new_amounts.keys() - old_amounts.keys()
+        if added:
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    ingredients_id=ingredient_id,
+                    amount=new_amounts[ingredient_id],
+                    recipes=recipe
+                )
+                for ingredient_id in added
             )
+        # updated_at рецепта обновит super().update.
+        with bulk_changes():
+            recipe.tags.set(tags)
+        ShoppingCartIngredient.objects.change_recipe(
+            recipe.id, old_amounts, new_amounts
+        )
         return super().update(recipe, validated_data)
 
 
@@ -249,20 +500,43 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_authenticated:
             return user.subscriber.filter(author=obj).exists()
         return False
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipe.count()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        count_limit = request.GET.get('recipes_limit')
-        recipe_obj = obj.recipe.all()
-        if count_limit:
-            recipe_obj = recipe_obj[:int(count_limit)]
+        if hasattr(obj, 'limited_recipes'):
+            recipe_obj = obj.limited_recipes
+        else:
+            request = self.context.get('request')
+            count_limit = request.GET.get('recipes_limit')
+            recipe_obj = obj.recipe.all()
+            if count_limit:
+                recipe_obj = recipe_obj[:int(count_limit)]
         return OptionalRecipeSerializer(
             recipe_obj, many=True
         ).data
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Список id для пакетного добавления или удаления, например:
+    {"ids": [1, 2, 3]}. Повторы убираются с сохранением порядка.
+    """
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
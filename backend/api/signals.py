@@ -0,0 +1,229 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.authentication import auth_namespace
+from api.versions import author_namespace, bump_version, user_namespace
+from recipes.images import schedule_variants, variants_outdated
+from recipes.models import (
+    FeedEntry, Favourite, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingCartIngredient, Tag
+)
+from users.models import Subscription, User, in_bulk_changes
+
+
+# Поля пользователя, которые выводятся в рецептах как автор.
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+def bump_on_commit(*namespaces):
+    for namespace in namespaces:
+        transaction.on_commit(partial(bump_version, namespace))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_on_commit('ingredients', 'recipes')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipes_changed(**kwargs):
+    bump_on_commit('recipes')
+
+
+def touch_recipes(recipe_ids):
+    """
+    Обновляет updated_at рецептов, у которых изменились ингредиенты
+    или теги без сохранения самого рецепта (админка, ORM): по нему
+    строятся ETag рецепта и ключи кэша его частей.
+    """
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredients_changed(instance, **kwargs):
+    if not in_bulk_changes():
+        touch_recipes([instance.recipes_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if in_bulk_changes():
+        return
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        touch_recipes([instance.pk])
+    elif reverse and action in ('post_add', 'post_remove'):
+        touch_recipes(pk_set)
+    elif reverse and action == 'pre_clear':
+        touch_recipes(Recipe.objects.filter(tags=instance).values('pk'))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(**kwargs):
+    bump_on_commit('tags', 'recipes')
+
+
+@receiver(pre_save, sender=User)
+def user_saving(instance, update_fields=None, **kwargs):
+    instance.author_changed = False
+    if not instance.pk or (
+        update_fields is not None
+        and not set(update_fields) & set(AUTHOR_FIELDS)
+    ):
+        return
+    if Recipe.objects.filter(author=instance.pk).exists():
+        instance.author_changed = User.objects.filter(
+            pk=instance.pk
+        ).values_list(*AUTHOR_FIELDS).first() != tuple(
+            getattr(instance, field) for field in AUTHOR_FIELDS
+        )
+
+
+# Рецепты удалённого пользователя удаляются вместе с ним и сами
+# увеличивают версию, поэтому post_delete пользователя не нужен.
+@receiver(post_save, sender=User)
+def users_changed(instance, **kwargs):
+    if getattr(instance, 'author_changed', False):
+        bump_on_commit('users', 'recipes', author_namespace(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(instance, **kwargs):
+    if variants_outdated(instance):
+        transaction.on_commit(
+            partial(schedule_variants, instance.pk, instance.image.name)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(FeedEntry.objects.fan_out, instance))
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(instance, created, **kwargs):
+    if not created:
+        return
+    User.objects.filter(pk=instance.author_id).update(
+        followers_count=F('followers_count') + 1
+    )
+    FeedEntry.objects.subscribe(instance.user_id, [instance.author_id])
+    bump_on_commit(user_namespace(instance.user_id))
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(instance, **kwargs):
+    if in_bulk_changes():
+        return
+    User.objects.filter(
+        pk=instance.author_id, followers_count__gt=0
+    ).update(followers_count=F('followers_count') - 1)
+    FeedEntry.objects.unsubscribe(instance.user_id, [instance.author_id])
+    bump_on_commit(user_namespace(instance.user_id))
+
+
+@receiver(post_save, sender=Favourite)
+@receiver(post_save, sender=ShoppingCart)
+def recipe_marked(sender, instance, created, **kwargs):
+    if created:
+        counter = sender.counter_field
+        Recipe.objects.filter(pk=instance.recipes_id).update(
+            **{counter: F(counter) + 1}
+        )
+        bump_on_commit(user_namespace(instance.user_id))
+
+
+@receiver(post_delete, sender=Favourite)
+@receiver(post_delete, sender=ShoppingCart)
+def recipe_unmarked(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    counter = sender.counter_field
+    Recipe.objects.filter(
+        pk=instance.recipes_id, **{f'{counter}__gt': 0}
+    ).update(**{counter: F(counter) - 1})
+    bump_on_commit(user_namespace(instance.user_id))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_recipe_added(instance, created, **kwargs):
+    if created and not in_bulk_changes():
+        ShoppingCartIngredient.objects.add_recipes(
+            instance.user_id, [instance.recipes_id]
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_recipe_removed(instance, **kwargs):
+    if not in_bulk_changes():
+        ShoppingCartIngredient.objects.remove_recipes(
+            instance.user_id, [instance.recipes_id]
+        )
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def recipe_ingredient_saving(instance, **kwargs):
+    instance.saved_row = None
+    if instance.pk and not in_bulk_changes():
+        instance.saved_row = IngredientRecipe.objects.filter(
+            pk=instance.pk
+        ).values_list('recipes', 'ingredients', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def recipe_ingredient_saved(instance, **kwargs):
+    if in_bulk_changes():
+        return
+    old_amounts = {}
+    if instance.saved_row is not None:
+        recipe_id, ingredient_id, amount = instance.saved_row
+        if recipe_id == instance.recipes_id:
+            old_amounts = {ingredient_id: amount}
+        else:
+            ShoppingCartIngredient.objects.change_recipe(
+                recipe_id, {ingredient_id: amount}, {}
+            )
+    ShoppingCartIngredient.objects.change_recipe(
+        instance.recipes_id, old_amounts,
+        {instance.ingredients_id: instance.amount}
+    )
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredient_deleted(instance, **kwargs):
+    if not in_bulk_changes():
+        ShoppingCartIngredient.objects.change_recipe(
+            instance.recipes_id, {instance.ingredients_id: instance.amount}, {}
+        )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Token)
+def credentials_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    namespace = auth_namespace(
+        instance.pk if sender is User else instance.user_id
+    )
+    # Сразу, чтобы другие запросы перестали брать токен из кэша,
+    # и после коммита, если между ними токен успели закэшировать заново.
+    bump_version(namespace)
+    transaction.on_commit(partial(bump_version, namespace))
@@ -0,0 +1,53 @@
+import base64
+import io
+
+from PIL import Image
+
+from recipes.models import Recipe
+from users.models import User
+
+
+def create_user(name, **fields):
+    """Пользователь name с почтой name@test.ru и паролем pass."""
+    return User.objects.create_user(
+        **{
+            'email': f'{name}@test.ru',
+            'username': name,
+            'first_name': 'Тест',
+            'last_name': 'Тестовый',
+            'password': 'pass',
+            **fields,
+        }
+    )
+
+
+def create_users(*names, **fields):
+    return [create_user(name, **fields) for name in names]
+
+
+def create_recipe(author, **fields):
+    """
+    Рецепт author с изображением, которого нет в MEDIA_ROOT. Варианты
+    изображения считаются созданными, чтобы сохранение рецепта
+    не запускало их обработку; для неё передайте image_variants={}.
+    """
+    fields = {
+        'author': author,
+        'name': 'Рецепт',
+        'image': 'recipes/images/test.png',
+        'text': 'Описание',
+        'cooking_time': 10,
+        **fields,
+    }
+    fields.setdefault('image_variants', {'original': fields['image']})
+    return Recipe.objects.create(**fields)
+
+
+def png_base64():
+    """Изображение PNG 64x64 в виде data URI для полей Base64ImageField."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
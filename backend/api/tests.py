@@ -0,0 +1,850 @@
+import io
+import json
+import math
+import os
+import pickle
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from api.authentication import TOKEN_KEY, token_cache
+from api.cache import response_cache
+from api.checks import check_version_cache
+from api.middleware import QueryLog
+from api.mixins import FastListMixin
+from api.metrics import MetricsStore, get_store
+from api.serializers import (
+    RECIPE_ROW_VALUES, RECIPE_VALUES, RecipeSerializer, cached_recipes,
+    represent_recipes
+)
+from api.testing import create_recipe, create_user, png_base64
+from api.versions import bump_version
+from recipes.models import (
+    Favourite, FeedEntry, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingCartIngredient, Tag
+)
+from users.models import Subscription, User
+
+SCALE = int(os.getenv('BENCHMARK_SCALE', 1))
+ITERATIONS = int(os.getenv('BENCHMARK_ITERATIONS', 10))
+RESULTS_PATH = os.getenv('BENCHMARK_RESULTS')
+SEED = 2023
+MEDIA_ROOT = tempfile.mkdtemp()
+METRICS_DIR = tempfile.mkdtemp()
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class EndpointBenchmarkTest(APITestCase):
+    """
+    Замеры эндпоинтов API на наборе данных, похожем на рабочий.
+    Для каждого эндпоинта считаются перцентили времени ответа и число
+    запросов к БД, число запросов не должно превышать бюджет budget.
+    Объём данных умножается на BENCHMARK_SCALE, число замеров задаёт
+    BENCHMARK_ITERATIONS, результаты в JSON пишутся в файл
+    BENCHMARK_RESULTS, чтобы сравнивать их между коммитами.
+    """
+
+    USERS = 60
+    RECIPES = 300
+    INGREDIENTS = 500
+    TAGS = 6
+    INGREDIENTS_PER_RECIPE = 8
+    FAVORITES_PER_USER = 15
+    CART_PER_USER = 6
+    SUBSCRIPTIONS_PER_USER = 8
+
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(SEED)
+        User.objects.bulk_create(
+            User(
+                email=f'user{number}@bench.ru', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия',
+                password='!unusable',
+            )
+            for number in range(cls.USERS * SCALE)
+        )
+        users = list(User.objects.order_by('pk'))
+        Tag.objects.bulk_create(
+            Tag(
+                name=f'Тег {number}', color=f'#0000{number:02X}',
+                slug=f'tag{number}'
+            )
+            for number in range(cls.TAGS)
+        )
+        tags = list(Tag.objects.order_by('pk'))
+        Ingredient.objects.bulk_create(
+            Ingredient(
+                name=f'Ингредиент {number}',
+                measurement_unit=rng.choice(('г', 'мл', 'шт.')),
+            )
+            for number in range(cls.INGREDIENTS * SCALE)
+        )
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=rng.choice(users),
+                name=f'Рецепт {number}',
+                image='recipes/images/bench.png',
+                text='Описание рецепта ' * 20,
+                cooking_time=rng.randint(5, 120),
+            )
+            for number in range(cls.RECIPES * SCALE)
+        )
+        recipes = list(Recipe.objects.order_by('pk'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            for recipe in recipes
+            for tag in rng.sample(tags, 2)
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipes=recipe, ingredients=ingredient,
+                amount=rng.randint(1, 500)
+            )
+            for recipe in recipes
+            for ingredient in rng.sample(
+                ingredients, cls.INGREDIENTS_PER_RECIPE
+            )
+        )
+        for model, size in (
+            (Favourite, cls.FAVORITES_PER_USER),
+            (ShoppingCart, cls.CART_PER_USER),
+        ):
+            model.objects.bulk_create(
+                model(user=user, recipes=recipe)
+                for user in users
+                for recipe in rng.sample(recipes, size)
+            )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=author)
+            for user in users
+            for author in rng.sample(users, cls.SUBSCRIPTIONS_PER_USER)
+            if author != user
+        )
+        for user in users:
+            FeedEntry.objects.subscribe(
+                user.id, user.subscriber.values_list('author', flat=True)
+            )
+        ShoppingCartIngredient.objects.rebuild()
+        call_command('reconcile_counters', stdout=io.StringIO())
+        cls.user = users[0]
+        cls.recipe = Recipe.objects.filter(author=cls.user).first() or (
+            recipes[0]
+        )
+        cls.tags = tags
+        cls.ingredients = ingredients
+        cls.image = png_base64()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        if RESULTS_PATH:
+            with open(RESULTS_PATH, 'w', encoding='utf8') as file:
+                json.dump(
+                    {
+                        'database': connection.vendor,
+                        'scale': SCALE,
+                        'iterations': ITERATIONS,
+                        'endpoints': cls.results,
+                    },
+                    file, indent=2, sort_keys=True, ensure_ascii=False
+                )
+
+    def setUp(self):
+        response_cache().clear()
+
+    def recipe_data(self):
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': self.image,
+            'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:8]
+            ],
+        }
+
+    def measure(self, name, budget, request, user=None, warm_up=False,
+                clear_cache=True):
+        self.client.force_authenticate(user)
+        if warm_up:
+            request()
+        timings = []
+        queries = 0
+        for _ in range(ITERATIONS):
+            if clear_cache:
+                response_cache().clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.assertLess(response.status_code, 300, name)
+            queries = max(queries, len(captured))
+        self.results[name] = {
+            'queries': queries,
+            'budget': budget,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'max_ms': round(max(timings), 3),
+        }
+        self.assertLessEqual(
+            queries, budget,
+            f'{name}: {queries} запросов к БД при бюджете {budget}'
+        )
+
+    def test_recipes_list(self):
+        url = reverse('api:recipes-list')
+        self.measure(
+            'recipes-list-anonymous', 4,
+            lambda: self.client.get(url, {'limit': 6})
+        )
+        self.measure(
+            'recipes-list-anonymous-cached', 0,
+            lambda: self.client.get(url, {'limit': 6}),
+            warm_up=True, clear_cache=False
+        )
+        self.measure(
+            'recipes-list', 4,
+            lambda: self.client.get(url, {'limit': 6}), user=self.user
+        )
+        self.measure(
+            'recipes-list-filtered', 5,
+            lambda: self.client.get(url, {
+                'limit': 6, 'tags': [tag.slug for tag in self.tags[:2]],
+                'is_favorited': 1,
+            }),
+            user=self.user
+        )
+        self.measure(
+            'recipes-list-popular', 4,
+            lambda: self.client.get(
+                url, {'limit': 6, 'ordering': '-favorites_count'}
+            ),
+            user=self.user
+        )
+        self.measure(
+            'recipes-list-cursor', 3,
+            lambda: self.client.get(url, {'limit': 6, 'cursor': ''}),
+            user=self.user
+        )
+
+    def test_fast_list(self):
+        url = reverse('api:recipes-list')
+        feed_url = reverse('api:recipes-feed')
+        for path, params, user in (
+            (url, {'limit': 100}, None),
+            (url, {'limit': 100}, self.user),
+            (url, {'limit': 100, 'cursor': ''}, self.user),
+            (url, {'limit': 20, 'ordering': '-favorites_count'}, None),
+            (url, {'limit': 20, 'tags': self.tags[0].slug}, self.user),
+            (url, {'limit': 20, 'is_favorited': 1}, self.user),
+            (feed_url, {'limit': 20}, self.user),
+        ):
+            self.client.force_authenticate(user)
+            contents = []
+            for fast, fragments in (
+                (False, False), (True, False), (False, True), (False, True)
+            ):
+                # Части рецептов из кэша не сбрасываются, второй
+                # запрос с RECIPE_FRAGMENT_CACHE читает их из кэша.
+                if not fragments:
+                    response_cache().clear()
+                with override_settings(
+                    FAST_LIST_RENDERING=fast, RECIPE_FRAGMENT_CACHE=fragments
+                ):
+                    contents.append(self.client.get(path, params).content)
+            for content in contents[1:]:
+                self.assertEqual(contents[0], content, (path, params))
+        for enabled, name in (
+            (False, 'recipes-list-100'), (True, 'recipes-list-100-fast')
+        ):
+            with override_settings(FAST_LIST_RENDERING=enabled):
+                self.measure(
+                    name, 4, lambda: self.client.get(url, {'limit': 100}),
+                    user=self.user
+                )
+        with override_settings(RECIPE_FRAGMENT_CACHE=True):
+            self.measure(
+                'recipes-list-100-fragments', 1,
+                lambda: self.client.get(url, {'limit': 100}),
+                user=self.user, warm_up=True, clear_cache=False
+            )
+
+    def test_recipes_detail(self):
+        url = reverse('api:recipes-detail', args=(self.recipe.id,))
+        self.measure(
+            'recipes-detail', 3, lambda: self.client.get(url), user=self.user
+        )
+
+    def test_recipes_create(self):
+        url = reverse('api:recipes-list')
+        self.measure(
+            'recipes-create', 14,
+            lambda: self.client.post(url, self.recipe_data(), format='json'),
+            user=self.user
+        )
+
+    def test_recipes_update(self):
+        url = reverse('api:recipes-detail', args=(self.recipe.id,))
+        self.measure(
+            'recipes-update', 21,
+            lambda: self.client.patch(url, self.recipe_data(), format='json'),
+            user=self.recipe.author
+        )
+
+    def test_recipes_feed(self):
+        url = reverse('api:recipes-feed')
+        self.measure(
+            'recipes-feed', 5,
+            lambda: self.client.get(url, {'limit': 6}), user=self.user
+        )
+
+    def test_shopping_cart(self):
+        url = reverse('api:recipes-shopping-cart-batch')
+        ids = list(
+            Recipe.objects.order_by('-pk').values_list('pk', flat=True)[:30]
+        )
+
+        def toggle():
+            self.client.delete(url, {'ids': ids}, format='json')
+            return self.client.post(url, {'ids': ids}, format='json')
+
+        # Удаление через QuerySet.delete() сначала выбирает строки.
+        self.measure('recipes-shopping-cart-batch', 33, toggle, self.user)
+        self.measure(
+            'recipes-download-shopping-cart', 1,
+            lambda: self.client.get(
+                reverse('api:recipes-download-shopping-cart'),
+                {'format': 'txt'}
+            ),
+            user=self.user
+        )
+
+    def test_subscriptions(self):
+        url = reverse('api:users-subscriptions')
+        self.measure(
+            'users-subscriptions', 3,
+            lambda: self.client.get(url, {'limit': 6, 'recipes_limit': 3}),
+            user=self.user
+        )
+
+    def test_ingredients_search(self):
+        url = reverse('api:ingredients-list')
+        self.measure(
+            'ingredients-search', 0,
+            lambda: self.client.get(url, {'name': 'Ингредиент 1'}),
+            warm_up=True
+        )
+
+    def test_tags(self):
+        self.measure(
+            'tags-list', 1, lambda: self.client.get(reverse('api:tags-list'))
+        )
+
+
+class FastListTest(APITestCase):
+    """Словари быстрого пути повторяют RecipeSerializer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        recipe = create_recipe(author)
+        recipe.tags.add(
+            Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        )
+        IngredientRecipe.objects.create(
+            recipes=recipe,
+            ingredients=Ingredient.objects.create(
+                name='Соль', measurement_unit='г'
+            ),
+            amount=5
+        )
+
+    def setUp(self):
+        response_cache().clear()
+
+    def keys(self, data):
+        """Ключи словарей на всех уровнях вложенности, по порядку."""
+        if isinstance(data, dict):
+            return [(key, self.keys(value)) for key, value in data.items()]
+        if isinstance(data, list):
+            return [self.keys(item) for item in data]
+        return None
+
+    def test_keys_match_serializer(self):
+        request = Request(APIRequestFactory().get('/'))
+        recipes = Recipe.objects.with_user_flags(request.user)
+        expected = RecipeSerializer(
+            recipes.with_related(), many=True, context={'request': request}
+        ).data
+        self.assertEqual(
+            [key for key, _ in self.keys(expected[0])],
+            list(RecipeSerializer.Meta.fields)
+        )
+        for represent, values in (
+            (represent_recipes, RECIPE_VALUES),
+            (cached_recipes, RECIPE_ROW_VALUES),
+        ):
+            with self.subTest(represent=represent.__name__):
+                data = represent(list(recipes.values(*values)), request)
+                self.assertEqual(self.keys(data), self.keys(expected))
+                self.assertEqual(data, expected)
+
+    def test_default_represent_rows(self):
+        rows = iter([{'id': 1, 'name': 'Рецепт'}])
+        self.assertEqual(
+            FastListMixin().represent_rows(rows),
+            [{'id': 1, 'name': 'Рецепт'}]
+        )
+
+
+@override_settings(METRICS_DIR=METRICS_DIR)
+class MetricsTest(APITestCase):
+    """Метрики эндпоинтов и их выдача в формате Prometheus."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+    def test_metrics(self):
+        for _ in range(2):
+            self.client.get(reverse('api:tags-list'))
+        other = MetricsStore(METRICS_DIR)
+        other.record('tags-list', 'GET', 200, 0.5, 3, 0.01, 100)
+        other.flush(force=True)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn(
+            'foodgram_http_requests_total'
+            '{route="tags-list",method="GET",status="200"} 3',
+            text
+        )
+        self.assertIn(
+            'foodgram_db_queries_per_request_bucket'
+            '{route="tags-list",method="GET",le="1"} 2',
+            text
+        )
+        self.assertIn(
+            'foodgram_db_queries_per_request_sum'
+            '{route="tags-list",method="GET"} 5',
+            text
+        )
+        self.assertIn(
+            'foodgram_http_request_duration_seconds_count'
+            '{route="tags-list",method="GET"} 3',
+            text
+        )
+
+    def test_response_cache_metrics(self):
+        response_cache().clear()
+        url = reverse('api:recipes-list')
+        for _ in range(3):
+            self.client.get(url)
+        other = MetricsStore(METRICS_DIR)
+        other.increment('response_cache_requests_total', ('hits',))
+        other.flush(force=True)
+        response_cache().clear()
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'foodgram_response_cache_requests_total{result="hits"} 3', text
+        )
+        self.assertIn(
+            'foodgram_response_cache_requests_total{result="misses"} 1', text
+        )
+
+    def test_metrics_internal_only(self):
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='203.0.113.1'
+        )
+        self.assertEqual(response.status_code, 404)
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(
+                reverse('metrics'), REMOTE_ADDR='203.0.113.1',
+                HTTP_AUTHORIZATION='Bearer secret'
+            )
+        self.assertEqual(response.status_code, 200)
+
+
+class ProfilingTest(APITestCase):
+    """Профилирование запросов для персонала и журнал медленных запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = create_user('staff', is_staff=True)
+        cls.user = create_user('user')
+        cls.url = reverse('api:recipes-list')
+
+    def get(self, user, **params):
+        token = Token.objects.create(user=user)
+        return self.client.get(
+            self.url, params, HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+
+    def test_staff_profile(self):
+        response = self.get(self.staff, profile='cprofile')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status_code'], 200)
+        self.assertEqual(
+            response.json()['query_count'], len(response.json()['queries'])
+        )
+        self.assertIn('serializers', response.json()['profile'])
+
+    def test_profile_ignored_for_users(self):
+        response = self.get(self.user, profile=1)
+        self.assertIn('results', response.json())
+        response = self.client.get(self.url, HTTP_X_PROFILE='1')
+        self.assertIn('results', response.json())
+
+    def test_repeated_queries(self):
+        log = QueryLog()
+        for params in ((1,), (2,), (2,)):
+            log(lambda *args: None, 'SELECT %s', params, False, {})
+        repeated = log.repeated()
+        self.assertEqual(repeated['similar'][0]['count'], 3)
+        self.assertEqual(repeated['duplicates'][0]['count'], 2)
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0, SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_query_log(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(reverse('api:tags-list'))
+        self.assertTrue(logs.output[0].startswith(
+            'WARNING:api.middleware:slow query'
+        ))
+        self.assertIn('slow request', logs.output[-1])
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    """Кэш токенов: проверка без БД и сброс при выходе и деактивации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+
+    def setUp(self):
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('api:users-me')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url)
+        return response, [
+            query for query in captured
+            if 'authtoken_token' in query['sql']
+        ]
+
+    def test_cached_token(self):
+        counters = get_store().counters
+        hits = counters['auth_token_cache_total', ('local',)]
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.token_queries()
+        self.assertEqual(response.data['id'], self.user.id)
+        self.assertEqual(queries, [])
+        self.assertEqual(
+            counters['auth_token_cache_total', ('local',)], hits + 1
+        )
+
+    def test_logout(self):
+        self.token_queries()
+        self.client.post(reverse('api:logout'))
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_password_change(self):
+        self.token_queries()
+        self.user.set_password('new-pass')
+        self.user.save()
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='default')
+    def test_shared_cache(self):
+        self.token_queries()
+        token_cache.clear()
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        self.token.delete()
+        token_cache.clear()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='default')
+    def test_password_not_cached(self):
+        self.token_queries()
+        token, _ = caches['default'].get(TOKEN_KEY.format(key=self.token.key))
+        self.assertIn('password', token.user.get_deferred_fields())
+        self.assertNotIn(self.user.password.encode(), pickle.dumps(token))
+        response = self.client.post(
+            reverse('api:users-set-password'),
+            {'current_password': 'pass', 'new_password': 'Nx7-long-pass'}
+        )
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('Nx7-long-pass'))
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token unknown')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Недопустимый токен.')
+
+
+class ShoppingListExportTest(APITestCase):
+    """Выгрузка списка покупок в txt, csv и pdf и ответы с ошибками."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        recipe = create_recipe(cls.user)
+        for name, amount in (('Соль', 5), ('Мука', 200)):
+            IngredientRecipe.objects.create(
+                recipes=recipe,
+                ingredients=Ingredient.objects.create(
+                    name=name, measurement_unit='г'
+                ),
+                amount=amount
+            )
+        cls.recipe = recipe
+        cls.url = reverse('api:recipes-download-shopping-cart')
+
+    def download(self, file_format):
+        response = self.client.get(self.url, {'format': file_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="shop_list.{file_format}"'
+        )
+        return response, b''.join(response.streaming_content)
+
+    def test_formats(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(
+            reverse('api:recipes-shopping-cart', args=(self.recipe.id,))
+        )
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        text = content.decode()
+        self.assertIn('Список покупок для reader', text)
+        self.assertLess(text.index('Мука 200 г'), text.index('Соль 5 г'))
+        response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            content.decode().splitlines(),
+            ['name,amount,measurement_unit', 'Мука,200,г', 'Соль,5,г']
+        )
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertTrue(content.rstrip().endswith(b'%%EOF'))
+
+    def test_empty_cart(self):
+        self.client.force_authenticate(self.user)
+        _, content = self.download('txt')
+        self.assertNotIn(' г\n', content.decode())
+        _, content = self.download('csv')
+        self.assertEqual(
+            content.decode().splitlines(), ['name,amount,measurement_unit']
+        )
+        _, content = self.download('pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_error_is_json(self):
+        for file_format in ('txt', 'csv', 'pdf'):
+            response = self.client.get(self.url, {'format': file_format})
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn('detail', json.loads(response.content))
+
+
+class IngredientSearchTest(APITestCase):
+    """Ранжирование поиска ингредиентов и сброс индекса после записи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in (
+            'Фасоль', 'Морская соль', 'Соль морская', 'Соль', 'Сахар',
+            'Соль йодированная',
+        ):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        # Откат транзакции теста не меняет версию, индекс сбрасывается явно.
+        bump_version('ingredients')
+
+    def search(self, name):
+        response = self.client.get(
+            reverse('api:ingredients-list'), {'name': name}
+        )
+        return [item['name'] for item in response.data]
+
+    def test_ranking(self):
+        self.assertEqual(self.search('соль'), [
+            'Соль', 'Соль йодированная', 'Соль морская', 'Морская соль',
+            'Фасоль',
+        ])
+        self.assertEqual(self.search('мор'), ['Морская соль', 'Соль морская'])
+        self.assertEqual(self.search('ахар'), ['Сахар'])
+        self.assertEqual(len(self.search('')), 6)
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_limit(self):
+        self.assertEqual(self.search(''), ['Морская соль', 'Сахар'])
+        self.assertEqual(self.search('соль'), ['Соль', 'Соль йодированная'])
+
+    def test_invalidation(self):
+        self.assertEqual(self.search('солод'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Солод', measurement_unit='г')
+        self.assertEqual(self.search('солод'), ['Солод'])
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf8'
+        ) as file:
+            file.write('Солодка,г\n')
+            file.flush()
+            call_command(
+                'unpack_ingredients', file=file.name, stdout=io.StringIO()
+            )
+        self.assertEqual(self.search('солод'), ['Солод', 'Солодка'])
+
+    def test_version_cache_check(self):
+        self.assertEqual(check_version_cache(None), [])
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}):
+            errors = check_version_cache(None)
+        self.assertEqual([error.id for error in errors], ['api.E001'])
+
+
+class UnpackIngredientsTest(APITestCase):
+    """Импорт ингредиентов из CSV и JSON с пропуском ошибочных строк."""
+
+    def unpack(self, content, suffix):
+        output = io.StringIO()
+        with tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf8'
+        ) as file:
+            file.write(content)
+            file.flush()
+            call_command('unpack_ingredients', file=file.name, stdout=output)
+        return output.getvalue()
+
+    def ingredients(self):
+        return set(Ingredient.objects.values_list('name', 'measurement_unit'))
+
+    def test_csv(self):
+        output = self.unpack(
+            'name,measurement_unit\n'
+            'Соль,г\n'
+            '\n'
+            'Сахар\n'
+            ' Мука , кг ,лишний столбец\n'
+            'Соль,г\n'
+            f'{"Я" * 201},г\n',
+            '.csv'
+        )
+        self.assertEqual(self.ingredients(), {('Соль', 'г'), ('Мука', 'кг')})
+        self.assertIn('Прочитано строк: 6, пропущено с ошибками: 3', output)
+        self.assertIn('Добавлено ингредиентов: 2.', output)
+        output = self.unpack('Соль,г\n', '.csv')
+        self.assertIn('Добавлено ингредиентов: 0.', output)
+
+    def test_json(self):
+        output = self.unpack(
+            json.dumps([
+                {'name': 'Соль', 'measurement_unit': 'г'},
+                5,
+                ['Сахар', 'г'],
+                None,
+                {'name': 'Мука'},
+                {'name': 7, 'measurement_unit': 'г'},
+                {'name': 'Мёд', 'measurement_unit': 'ст. л.'},
+            ], ensure_ascii=False),
+            '.json'
+        )
+        self.assertEqual(
+            self.ingredients(), {('Соль', 'г'), ('Мёд', 'ст. л.')}
+        )
+        self.assertIn('Прочитано строк: 7, пропущено с ошибками: 5', output)
+
+
+class GenerateDatasetTest(APITestCase):
+    """Синтетический набор данных для замеров."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(20)
+        )
+
+    def generate(self, **options):
+        call_command(
+            'generate_dataset', users=10, recipes=30, tags=3,
+            favorites=3, carts=2, subscriptions=2, workers=1,
+            stdout=io.StringIO(), **options
+        )
+
+    def test_rows_and_pub_dates(self):
+        self.generate(days=30)
+        recipes = Recipe.objects.filter(name__startswith='gen ')
+        self.assertEqual(
+            User.objects.filter(username__startswith='gen').count(), 10
+        )
+        self.assertEqual(recipes.count(), 30)
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(recipes.values('pub_date').distinct().count(), 30)
+        pub_dates = list(recipes.order_by('pk').values_list(
+            'pub_date', flat=True
+        ))
+        self.assertEqual(pub_dates, sorted(pub_dates))
+        self.assertLessEqual((pub_dates[-1] - pub_dates[0]).days, 30)
+        self.assertFalse(IngredientRecipe.objects.exclude(
+            recipes__in=recipes
+        ).exists())
+        for recipe in recipes.annotate(
+            favorites=Count('favorited')
+        ):
+            self.assertEqual(recipe.favorites_count, recipe.favorites)
+
+    def test_requires_ingredients(self):
+        Ingredient.objects.all().delete()
+        with self.assertRaisesMessage(CommandError, 'unpack_ingredients'):
+            self.generate()
@@ -0,0 +1,90 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'version:{namespace}'
+MODIFIED_KEY = 'modified:{namespace}'
+
+
+def version_cache():
+    """Кэш версий, общий для всех процессов (см. проверку api.E001)."""
+    return caches[settings.VERSION_CACHE_ALIAS]
+
+
+def user_namespace(user_id):
+    """Набор данных пользователя: избранное, покупки и подписки."""
+    return f'user:{user_id}'
+
+
+def author_namespace(user_id):
+    """Данные пользователя, которые выводятся в его рецептах как автор."""
+    return f'author:{user_id}'
+
+
+def get_version(namespace):
+    """
+    Возвращает версию набора данных (например, ingredients).
+    Начальная версия берётся от текущего времени, поэтому после
+    очистки кэша она не совпадёт ни с одной из прежних версий.
+    """
+    cache = version_cache()
+    key = VERSION_KEY.format(namespace=namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """Меняет версию набора данных после изменения записей."""
+    cache = version_cache()
+    cache.set(MODIFIED_KEY.format(namespace=namespace), time.time(), None)
+    key = VERSION_KEY.format(namespace=namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+        return cache.get(key)
+
+
+def get_modified(namespace):
+    """
+    Время последнего изменения набора данных (timestamp). Если оно
+    неизвестно, например после очистки кэша, считается текущим.
+    """
+    cache = version_cache()
+    key = MODIFIED_KEY.format(namespace=namespace)
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, time.time(), None)
+        modified = cache.get(key)
+    return modified
+
+
+def get_versions(*namespaces):
+    """
+    Версии и время последнего изменения нескольких наборов данных
+    одним обращением к кэшу.
+    """
+    cache = version_cache()
+    keys = {
+        namespace: (
+            VERSION_KEY.format(namespace=namespace),
+            MODIFIED_KEY.format(namespace=namespace),
+        )
+        for namespace in namespaces
+    }
+    values = cache.get_many([key for pair in keys.values() for key in pair])
+    versions, modified = [], []
+    for namespace, (version_key, modified_key) in keys.items():
+        version = values.get(version_key)
+        versions.append(
+            get_version(namespace) if version is None else version
+        )
+        timestamp = values.get(modified_key)
+        modified.append(
+            get_modified(namespace) if timestamp is None else timestamp
+        )
+    return versions, modified
@@ -1,6 +1,7 @@
-from datetime import datetime as dt
-from django.db.models import Sum
-from django.http import FileResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from djoser.views import UserViewSet
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
@@ -8,50 +9,130 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
+from rest_framework.renderers import BrowsableAPIRenderer
 
-from api.filters import FilterForRecipes, FilterForIngredients
+from api.cache import AnonymousCacheMixin, ConditionalGetMixin
+from api.filters import FilterForRecipes
+from api.ingredient_index import get_ingredient_index
+from api.mixins import FastListMixin
 from api.permissions import IsAuthorOrReadOnlyPermission
-from api.pagination import ModifiedPagination
+from api.pagination import (
+    FeedCursorPagination, ModifiedPagination, RecipeCursorPagination,
+    SubscriptionCursorPagination,
+)
+from api.renderers import (
+    CsvShoppingListRenderer, FastJSONRenderer,
+    JsonShoppingListRenderer, PdfShoppingListRenderer,
+    TxtShoppingListRenderer,
+)
 from api.serializers import (
     TagSerializer, IngredientSerializer, CustomUserSerializer,
     CreateRecipeSerializer, RecipeSerializer, SubscriptionSerializer,
-    OptionalRecipeSerializer,
+    OptionalRecipeSerializer, BatchSerializer, RECIPE_ROW_VALUES,
+    RECIPE_VALUES, cached_recipes, represent_recipes,
 )
-from recipes.models import Tag, Ingredient, Recipe, IngredientRecipe
+from api.versions import bump_version, user_namespace
+from recipes.models import (
+    Favourite, FeedEntry, Tag, Ingredient, Recipe, ShoppingCart,
+    ShoppingCartIngredient,
+)
+
+from users.models import Subscription, User
 
-from users.models import User
+
+def get_batch_ids(request):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
+
+
+def batch_results(request, ids, found, changed, rejected=None):
+    """
+    Результат пакетного запроса по каждому id в порядке запроса:
+    added/exists для POST, removed/missing для DELETE, not_found для
+    несуществующих объектов и статусы из rejected для отклонённых.
+    """
+    rejected = rejected or {}
+    changed = set(changed)
+    done, skipped = (
+        ('added', 'exists') if request.method == 'POST'
+        else ('removed', 'missing')
+    )
+    results = []
+    for pk in ids:
+        if pk in rejected:
+            result = rejected[pk]
+        elif pk not in found:
+            result = 'not_found'
+        else:
+            result = done if pk in changed else skipped
+        results.append({'id': pk, 'status': result})
+    return Response({'results': results})
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
-    """Список и информация об ингредиентах."""
+class IngredientViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Список и информация об ингредиентах. Список с поиском по имени(name)
+    отдаётся из индекса в памяти процесса без запросов к БД, например:
+    вводишь буквы "бал" выдаёт балык, бальзам, затем "уксус бальзамический".
+    В ответе не больше INGREDIENT_SEARCH_LIMIT ингредиентов.
+    """
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = FilterForIngredients
+    conditional_namespaces = ('ingredients',)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.search, request)
 
+    def search(self, request):
+        return Response(get_ingredient_index().search(
+            request.query_params.get('name', ''),
+            settings.INGREDIENT_SEARCH_LIMIT
+        ))
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Список и инофрмация о тегах."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    conditional_namespaces = ('tags',)
 
 
 class UserViewSet(UserViewSet):
     """
-    Получение списка подписок на пользователей с двумя доп. методами:
+    Получение списка подписок на пользователей с четырьмя доп. методами:
     1) subscribe - подписка и отписка на других пользователей.
-    2) subscriptions - Возвращает пользователей,
+    2) subscribe_batch - подписка и отписка на список авторов
+    {"ids": [...]} одной транзакцией.
+    3) subscriptions - Возвращает пользователей,
     на которых подписан текущий пользователь.
+    4) prefetch_recipes - одним запросом подгружает авторам
+    последние recipes_limit рецептов.
     """
 
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = (IsAuthenticated,)
     pagination_class = ModifiedPagination
+    cursor_pagination_class = None
     lookup_value_regex = r'\d+'
 
+    def get_queryset(self):
+        return super().get_queryset().with_subscription(self.request.user)
+
+    def prefetch_recipes(self, authors):
+        recipes = Recipe.objects.filter(author__in=authors)
+        recipes_limit = self.request.query_params.get('recipes_limit', '')
+        if recipes_limit.isdigit() and int(recipes_limit):
+            recipes = recipes.latest_by_author(int(recipes_limit))
+        prefetch_related_objects(
+            authors,
+            Prefetch('recipe', queryset=recipes, to_attr='limited_recipes')
+        )
+        return authors
+
     @action(
         methods=['post', 'delete'],
         detail=True,
@@ -74,13 +155,17 @@ class UserViewSet(UserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             request.user.subscriber.create(author=author_recipe)
+            authors = self.prefetch_recipes(list(
+                User.objects.filter(id=author_recipe.id).with_subscription(
+                    request.user
+                ).with_recipes_count()
+            ))
             serializer = SubscriptionSerializer(
-                User.objects.filter(username=author_recipe),
-                many=True,
+                authors[0],
                 context={'request': request}
             )
             return Response(
-                serializer.data[0],
+                serializer.data,
                 status=status.HTTP_201_CREATED
             )
         if subscribe_queryset.exists():
@@ -94,44 +179,171 @@ class UserViewSet(UserViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='subscribe',
+        url_name='subscribe-batch',
+        permission_classes=(IsAuthenticated,),
+    )
+    def subscribe_batch(self, request):
+        ids = get_batch_ids(request)
+        found = set(
+            User.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        author_ids = [
+            pk for pk in ids if pk in found and pk != request.user.pk
+        ]
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = Subscription.objects.add(request.user, author_ids)
+                FeedEntry.objects.subscribe(request.user.pk, changed)
+            else:
+                changed = Subscription.objects.remove(
+                    request.user, author_ids
+                )
+                FeedEntry.objects.unsubscribe(request.user.pk, changed)
+        if changed:
+            bump_version(user_namespace(request.user.pk))
+        return batch_results(
+            request, ids, found, changed, rejected={request.user.pk: 'self'}
+        )
+
     @action(
         methods=['get'],
         detail=False,
         permission_classes=(IsAuthenticated,),
+        cursor_pagination_class=SubscriptionCursorPagination,
     )
     def subscriptions(self, request):
-        sub_queryset = self.paginate_queryset(
-            User.objects.filter(subscribe__user=request.user)
-        )
+        sub_queryset = self.prefetch_recipes(self.paginate_queryset(
+            User.objects.filter(
+                subscribe__user=request.user
+            ).with_subscription(request.user).with_recipes_count().annotate(
+                subscription_id=F('subscribe__id')
+            ).order_by('-subscription_id')
+        ))
         serializer = SubscriptionSerializer(sub_queryset,
                                             many=True,
                                             context={'request': request})
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ConditionalGetMixin, AnonymousCacheMixin, FastListMixin,
+    viewsets.ModelViewSet
+):
     """
-    CRUD для рецепта с 4 методами.
+    CRUD для рецепта с 8 методами.
     1) get_serializer_class - в взависимости от запроса вызывает сериализатор,
     если для просмотра рецепта RecipesSerializer,
     для остальных запросов CreateRecipeSerializer.
     2) favorite - добавляет или удаляет рецепт из избранного.
     3) shopping_cart - добавляет или удаляет рецепт из покупок.
-    4) download_shopping_cart - скачивает ингредиенты в txt формате.
+    4) download_shopping_cart - скачивает ингредиенты в формате
+    txt, csv, json или pdf (параметр format).
+    5) feed - лента рецептов авторов, на которых подписан пользователь.
+    6) favorite_batch и shopping_cart_batch - добавляют или удаляют
+    список рецептов {"ids": [...]} одной транзакцией.
+    7) get_object_state - время изменения и счётчики рецепта для
+    ETag и Last-Modified.
+    8) represent_rows - список и лента без сериализаторов
+    при FAST_LIST_RENDERING, а при RECIPE_FRAGMENT_CACHE - из
+    кэшированных частей рецептов с флагами пользователя.
+    Список и рецепт для неавторизованных пользователей кэшируются,
+    на условные запросы без изменений отвечают 304.
     """
 
     queryset = Recipe.objects.all()
     pagination_class = ModifiedPagination
+    cursor_pagination_class = RecipeCursorPagination
     permission_classes = (IsAuthorOrReadOnlyPermission,)
+    cache_namespace = 'recipes'
+    conditional_max_age = settings.RESPONSE_CACHE_TIMEOUT
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = FilterForRecipes
     lookup_value_regex = r'\d+'
 
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
+        )
+
+    def fast_list_enabled(self):
+        return settings.RECIPE_FRAGMENT_CACHE or super().fast_list_enabled()
+
+    def get_fast_queryset(self):
+        return Recipe.objects.with_user_flags(self.request.user)
+
+    def get_fast_list_values(self):
+        if settings.RECIPE_FRAGMENT_CACHE:
+            return (*RECIPE_ROW_VALUES, 'pub_date')
+        return (*RECIPE_VALUES, 'pub_date')
+
+    def represent_rows(self, rows):
+        if settings.RECIPE_FRAGMENT_CACHE:
+            return cached_recipes(rows, self.request)
+        return represent_recipes(rows, self.request)
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeSerializer
         return CreateRecipeSerializer
 
+    def get_conditional_namespaces(self):
+        # Рецепт меняет updated_at, поэтому для него достаточно версий
+        # связанных наборов данных, а не всех рецептов.
+        if self.action == 'retrieve':
+            return ('tags', 'ingredients', 'users')
+        return ('recipes',)
+
+    def get_object_state(self, instance=None):
+        if instance is None:
+            instance = Recipe.objects.filter(
+                pk=self.kwargs[self.lookup_field]
+            ).only('updated_at', 'favorites_count', 'in_carts_count').first()
+            if instance is None:
+                return None
+        state = instance.updated_at.isoformat()
+        # Неавторизованным рецепт может прийти из кэша ответов,
+        # где счётчики отстают, поэтому они в ETag не входят.
+        if self.request.user.is_authenticated:
+            state += f':{instance.favorites_count}:{instance.in_carts_count}'
+        return state, instance.updated_at.timestamp()
+
+    def get_count_cache_namespace(self):
+        # Избранное, покупки и лента меняются без смены версии рецептов,
+        # поэтому количество для них не кэшируется.
+        if self.action != 'list' or {
+            'is_favorited', 'is_in_shopping_cart'
+        } & set(self.request.query_params):
+            return None
+        return self.cache_namespace
+
+    @action(
+        methods=['get'],
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        cursor_pagination_class=FeedCursorPagination,
+    )
+    def feed(self, request):
+        if self.use_fast_list(request):
+            return self.fast_list(
+                self.filter_queryset(self.get_fast_queryset()).feed(
+                    request.user
+                ),
+                'feed_pub_date'
+            )
+        queryset = self.filter_queryset(
+            self.get_queryset()
+        ).feed(request.user)
+        page = self.paginate_queryset(queryset)
+        serializer = RecipeSerializer(
+            page, many=True, context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)
+
     @action(
         methods=['post', 'delete'],
         detail=True,
@@ -174,7 +386,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     'Рецепт добавлен в список покупок',
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            request.user.shopping.create(recipes=recipe_obj)
+            with transaction.atomic():
+                request.user.shopping.create(recipes=recipe_obj)
             serializer = OptionalRecipeSerializer(recipe_obj)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if shopping_queryset.exists():
@@ -188,37 +401,75 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def change_batch(self, request, model):
+        ids = get_batch_ids(request)
+        found = set(
+            Recipe.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        recipe_ids = [pk for pk in ids if pk in found]
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = model.objects.add(request.user, recipe_ids)
+                if model is ShoppingCart:
+                    ShoppingCartIngredient.objects.add_recipes(
+                        request.user.pk, changed
+                    )
+            else:
+                changed = model.objects.remove(request.user, recipe_ids)
+                if model is ShoppingCart:
+                    ShoppingCartIngredient.objects.remove_recipes(
+                        request.user.pk, changed
+                    )
+        if changed:
+            bump_version(user_namespace(request.user.pk))
+        return batch_results(request, ids, found, changed)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='favorite',
+        url_name='favorite-batch',
+        permission_classes=(IsAuthenticated,),
+    )
+    def favorite_batch(self, request):
+        return self.change_batch(request, Favourite)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=(IsAuthenticated,),
+    )
+    def shopping_cart_batch(self, request):
+        return self.change_batch(request, ShoppingCart)
+
     @action(
         methods=['get'],
         detail=False,
         permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            TxtShoppingListRenderer, CsvShoppingListRenderer,
+            JsonShoppingListRenderer, PdfShoppingListRenderer,
+        ),
     )
     def download_shopping_cart(self, request):
-        shop_ingredient = IngredientRecipe.objects.filter(
-            recipes__shopping__user=request.user
+        renderer = request.accepted_renderer
+        shop_ingredient = ShoppingCartIngredient.objects.filter(
+            user=request.user
         ).values(
-            'ingredients__name',
-            'ingredients__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        file_path = 'shop_list.txt'
-        with open(file_path, 'w', encoding='utf8') as f:
-            f.write(
-                f'Список покупок для {request.user.username}\n'
-                f'\nДата покупки - {dt.today():%d.%m.%Y}\n'
-            )
-            for buy in shop_ingredient:
-                f.write(
-                    f'\n{buy["ingredients__name"]}'
-                    f' {buy["amount"]}'
-                    f' {buy["ingredients__measurement_unit"]}'
-                    '\n-----------------------------------------------'
-                )
-            f.write(
-                '\n\nСпасибо, что пользуетесь нашим сайтом!'
-                ' Будем Ждать вас снова! =)'
-            )
-        response = FileResponse(open(file_path, 'rb'))
+            'amount',
+            name=F('ingredients__name'),
+            measurement_unit=F('ingredients__measurement_unit'),
+        ).order_by('name')
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(request.user, shop_ingredient.iterator()),
+            content_type=content_type,
+        )
         response['Content-Disposition'] = (
-            'attachment; filename="shop_list.txt"'
+            f'attachment; filename="shop_list.{renderer.format}"'
         )
         return response
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -27,6 +28,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework.authtoken',
     'rest_framework',
     'djoser',
@@ -40,11 +42,13 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.User'
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,7 +81,7 @@ WSGI_APPLICATION = 'foodgram_project.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
@@ -87,6 +91,50 @@ DATABASES = {
 }
 
 
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    # Нужен пакет django-redis.
+    'redis': 'django_redis.cache.RedisCache',
+}
+
+# В кэше default хранятся версии данных, по которым сбрасываются кэши
+# ответов, ETag, индекс ингредиентов и токены. Он должен быть общим для
+# всех процессов: файловый кэш - для воркеров и команд manage.py одного
+# контейнера, Redis - для нескольких контейнеров. Кэш в памяти процесса
+# отклоняется проверкой api.E001.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram-cache')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'responses': {
+        'BACKEND': RESPONSE_CACHE_BACKENDS[
+            os.getenv('RESPONSE_CACHE_BACKEND', 'locmem')
+        ],
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+        'TIMEOUT': None,
+    },
+}
+
+VERSION_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+COUNT_CACHE_TIMEOUT = int(os.getenv('COUNT_CACHE_TIMEOUT', 60))
+# Для выборок без фильтров на PostgreSQL брать оценку pg_class.reltuples
+# вместо COUNT(*), если в таблице не меньше этого числа строк; 0 - выключено.
+APPROXIMATE_COUNT_THRESHOLD = int(
+    os.getenv('APPROXIMATE_COUNT_THRESHOLD', 0)
+)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -129,6 +177,84 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Наибольшее число ингредиентов в ответе поиска, в том числе без name:
+# фронтенд запрашивает список только по введённым буквам.
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+IMAGE_VARIANTS_WORKERS = int(os.getenv('IMAGE_VARIANTS_WORKERS', 2))
+IMAGE_VARIANTS_SYNC = os.getenv('IMAGE_VARIANTS_SYNC', 'False') == 'True'
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Рецепты авторов, у которых подписчиков больше FEED_FANOUT_LIMIT,
+# не раскладываются по лентам, а читаются из рецептов при запросе ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+FEED_BATCH_SIZE = int(os.getenv('FEED_BATCH_SIZE', 1000))
+FEED_BACKFILL_SIZE = int(os.getenv('FEED_BACKFILL_SIZE', 100))
+
+# Метрики для Prometheus: каждый процесс пишет свой файл в METRICS_DIR,
+# эндпоинт /metrics складывает их. Каталог очищается при деплое.
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'foodgram-metrics')
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+METRICS_ALLOWED_IPS = os.getenv(
+    'METRICS_ALLOWED_IPS', '127.0.0.1,::1'
+).split(',')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Журнал медленных SQL-запросов и запросов к API, пороги в миллисекундах.
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', 200))
+SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', 1000))
+SLOW_QUERY_LOG = os.getenv(
+    'SLOW_QUERY_LOG', os.path.join(tempfile.gettempdir(), 'foodgram-slow.log')
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'slow': {'format': '{asctime} {process} {message}', 'style': '{'},
+    },
+    'handlers': {
+        'slow': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf8',
+            'delay': True,
+            'formatter': 'slow',
+        },
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['slow'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Кэш токенов API: в памяти процесса и, если задан псевдоним кэша,
+# в общем кэше для всех воркеров.
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 60))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_ALIAS = os.getenv('AUTH_TOKEN_CACHE_ALIAS', '')
+
+# Списки рецептов из values() без сериализаторов, JSON через orjson,
+# если пакет установлен. Ответ тот же, что и без этой настройки.
+FAST_LIST_RENDERING = os.getenv('FAST_LIST_RENDERING', 'False') == 'True'
+# Общая для всех пользователей часть рецептов в списках берётся
+# из кэша ответов, флаги пользователя добавляются поверх.
+RECIPE_FRAGMENT_CACHE = (
+    os.getenv('RECIPE_FRAGMENT_CACHE', 'False') == 'True'
+)
+RECIPE_FRAGMENT_TIMEOUT = int(os.getenv('RECIPE_FRAGMENT_TIMEOUT', 3600))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -140,7 +266,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
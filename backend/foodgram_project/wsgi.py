@@ -10,7 +10,15 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_project.settings')
 
 application = get_wsgi_application()
+
+try:
+    from api.ingredient_index import get_ingredient_index
+
+    get_ingredient_index()
+except DatabaseError:
+    pass
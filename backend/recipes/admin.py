@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Q
 
 from recipes.models import (
     Favourite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag
@@ -9,42 +10,123 @@ admin.site.site_title = 'Админ-панель сайта Фудграм'
 admin.site.site_header = 'Админ-панель сайта Фудграм'
 
 
-class IngredientInline(admin.StackedInline):
+class InputFilter(admin.SimpleListFilter):
     """
-    Allows profile to be added when creating user
+    Фильтр с полем ввода вместо списка всех значений: для полей
+    с большим количеством значений (авторы, пользователи) список
+    в боковой панели строится запросом по всей таблице.
     """
+
+    template = 'admin/input_filter.html'
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        return ((None, None),)
+
+    def choices(self, changelist):
+        query_parts = changelist.get_filters_params()
+        query_parts.pop(self.parameter_name, None)
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.parameter_name]
+            ),
+            'query_parts': query_parts.items(),
+        }
+
+
+class AuthorFilter(InputFilter):
+    """Фильтр по юзернейму или почте автора."""
+
+    title = 'автору'
+    parameter_name = 'author'
+    placeholder = 'Юзернейм или почта'
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value:
+            return queryset.filter(
+                Q(author__username=value) | Q(author__email=value)
+            )
+        return queryset
+
+
+class UserFilter(AuthorFilter):
+    """Фильтр по юзернейму или почте пользователя."""
+
+    title = 'пользователю'
+    parameter_name = 'user'
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value:
+            return queryset.filter(
+                Q(user__username=value) | Q(user__email=value)
+            )
+        return queryset
+
+
+class IngredientInline(admin.TabularInline):
+    """Ингредиенты рецепта с поиском ингредиента по названию."""
+
     model = IngredientRecipe
+    autocomplete_fields = ('ingredients',)
     extra = 1
     min_num = 1
 
 
+@admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
 
     list_display = (
         'name',
         'author',
-        'count_favorites'
+        'pub_date',
+        'favorites_count',
+        'in_carts_count',
     )
-    list_filter = ('author', 'name', 'tags')
-    filter_horizontal = ('ingredients',)
+    list_select_related = ('author',)
+    list_filter = (AuthorFilter, 'tags')
+    search_fields = ('name',)
+    autocomplete_fields = ('author',)
     inlines = [IngredientInline]
+    show_full_result_count = False
 
-    def count_favorites(self, obj):
-        return obj.favorited.count()
 
-
-class IngredientInRecipeAdmin(admin.ModelAdmin):
+@admin.register(Ingredient)
+class IngredientAdmin(admin.ModelAdmin):
 
     list_display = (
         'name',
         'measurement_unit',
     )
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
+    search_fields = ('^name',)
+    ordering = ('name',)
+    show_full_result_count = False
+
+
+@admin.register(IngredientRecipe)
+class IngredientRecipeAdmin(admin.ModelAdmin):
+
+    list_display = ('recipes', 'ingredients', 'amount')
+    list_select_related = ('recipes', 'ingredients')
+    autocomplete_fields = ('recipes', 'ingredients')
+    show_full_result_count = False
+
+
+@admin.register(Favourite, ShoppingCart)
+class UserRecipeAdmin(admin.ModelAdmin):
+
+    list_display = ('user', 'recipes')
+    list_select_related = ('user', 'recipes')
+    list_filter = (UserFilter,)
+    autocomplete_fields = ('user', 'recipes')
+    show_full_result_count = False
+
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
 
-admin.site.register(Favourite)
-admin.site.register(Ingredient, IngredientInRecipeAdmin)
-admin.site.register(IngredientRecipe)
-admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(ShoppingCart)
-admin.site.register(Tag)
+    list_display = ('name', 'color', 'slug')
+    search_fields = ('name', 'slug')
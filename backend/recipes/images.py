@@ -0,0 +1,117 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/images/variants'
+VARIANTS = (
+    ('thumbnail', 320, 'JPEG', 'jpg'),
+    ('thumbnail_webp', 320, 'WEBP', 'webp'),
+    ('medium', 800, 'JPEG', 'jpg'),
+    ('medium_webp', 800, 'WEBP', 'webp'),
+)
+
+_process_executor = None
+_thread_executor = None
+
+
+def build_variants(media_root, recipe_id, name):
+    """
+    Создаёт уменьшенные копии изображения рецепта в каталоге рецепта
+    и возвращает словарь {вариант: путь к файлу}. Выполняется
+    в отдельном процессе, поэтому работает только с файлами
+    и не обращается к Django.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    directory = f'{VARIANTS_DIR}/{recipe_id}'
+    os.makedirs(os.path.join(media_root, directory), exist_ok=True)
+    variants = {'original': name}
+    with Image.open(os.path.join(media_root, name)) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for variant, size, image_format, extension in VARIANTS:
+            resized = image.copy()
+            resized.thumbnail((size, size))
+            if image_format == 'JPEG':
+                resized = resized.convert('RGB')
+            variant_name = f'{directory}/{stem}_{variant}.{extension}'
+            resized.save(
+                os.path.join(media_root, variant_name),
+                image_format,
+                quality=80
+            )
+            variants[variant] = variant_name
+    return variants
+
+
+def variants_outdated(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('original') != recipe.image.name
+    )
+
+
+def save_variants(recipe_id, name, variants):
+    """Сохраняет новые варианты и удаляет файлы прежних."""
+    recipe = Recipe.objects.filter(pk=recipe_id, image=name).first()
+    if recipe is None:
+        return
+    outdated = {
+        path for variant, path in recipe.image_variants.items()
+        if variant != 'original'
+    } - set(variants.values())
+    recipe.image_variants = variants
+    recipe.save(update_fields=['image_variants', 'updated_at'])
+    for path in outdated:
+        default_storage.delete(path)
+
+
+def get_process_executor():
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_VARIANTS_WORKERS
+        )
+    return _process_executor
+
+
+def process_image(recipe_id, name):
+    try:
+        variants = get_process_executor().submit(
+            build_variants, str(settings.MEDIA_ROOT), recipe_id, name
+        ).result()
+        save_variants(recipe_id, name, variants)
+    except Exception:
+        logger.exception(
+            'Не удалось создать варианты изображения %s рецепта %s',
+            name, recipe_id
+        )
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe_id, name):
+    """
+    Ставит создание вариантов изображения в очередь. Ресайз выполняется
+    в пуле процессов, а запись результата в БД - в фоновом потоке,
+    поэтому запрос с загрузкой изображения их не ждёт.
+    """
+    global _thread_executor
+    if settings.IMAGE_VARIANTS_SYNC:
+        save_variants(recipe_id, name, build_variants(
+            str(settings.MEDIA_ROOT), recipe_id, name
+        ))
+        return
+    if _thread_executor is None:
+        _thread_executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_VARIANTS_WORKERS
+        )
+    _thread_executor.submit(process_image, recipe_id, name)
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:39
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('pg_catalog.russian', "
+    "coalesce({table}.name, '')), 'A') || "
+    "setweight(to_tsvector('pg_catalog.russian', "
+    "coalesce({table}.text, '')), 'B')"
+)
+
+CREATE_SQL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX recipes_recipe_name_trgm ON recipes_recipe '
+    'USING gin (UPPER(name::text) gin_trgm_ops)',
+    'CREATE INDEX recipes_recipe_text_trgm ON recipes_recipe '
+    'USING gin (UPPER(text) gin_trgm_ops)',
+    'CREATE INDEX recipes_recipe_search_vector ON recipes_recipe '
+    'USING gin (search_vector)',
+    'CREATE FUNCTION recipes_recipe_search_vector_update() '
+    'RETURNS trigger AS $$ BEGIN NEW.search_vector := '
+    + SEARCH_VECTOR.format(table='NEW')
+    + '; RETURN NEW; END $$ LANGUAGE plpgsql',
+    'CREATE TRIGGER recipes_recipe_search_vector_trigger '
+    'BEFORE INSERT OR UPDATE ON recipes_recipe FOR EACH ROW '
+    'EXECUTE FUNCTION recipes_recipe_search_vector_update()',
+    'UPDATE recipes_recipe SET search_vector = '
+    + SEARCH_VECTOR.format(table='recipes_recipe'),
+)
+
+DROP_SQL = (
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+    'ON recipes_recipe',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update()',
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector',
+    'DROP INDEX IF EXISTS recipes_recipe_text_trgm',
+    'DROP INDEX IF EXISTS recipes_recipe_name_trgm',
+)
+
+
+def run_postgres_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            run_postgres_sql(CREATE_SQL), run_postgres_sql(DROP_SQL)
+        ),
+    ]
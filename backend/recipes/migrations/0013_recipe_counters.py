@@ -0,0 +1,48 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:50
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+
+    def count_by(model_name):
+        model = apps.get_model('recipes', model_name)
+        return Coalesce(models.Subquery(
+            model.objects.filter(
+                recipes=models.OuterRef('pk')
+            ).order_by().values('recipes').annotate(
+                total=models.Count('pk')
+            ).values('total')
+        ), 0)
+
+    Recipe.objects.update(
+        favorites_count=count_by('Favourite'),
+        in_carts_count=count_by('ShoppingCart'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,17 @@
 from colorfield.fields import ColorField
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+)
+from django.db import connection, models, transaction
 from django.core.validators import MinValueValidator, RegexValidator
+from django.db.models import (
+    Case, Exists, F, OuterRef, Prefetch, Q, Sum, Value, When, Window
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
-from users.models import User
+from users.models import Subscription, User, bulk_changes, count_by
 
 
 class Tag(models.Model):
@@ -67,6 +76,116 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """
+    Запросы для рецептов с 5 методами:
+    1) with_related - подгружает автора, теги и ингредиенты
+    фиксированным числом запросов, независимо от количества рецептов.
+    2) with_user_flags - добавляет в запрос поля is_favorited,
+    is_in_shopping_cart и author_is_subscribed для пользователя.
+    3) latest_by_author - оставляет не больше limit последних рецептов
+    каждого автора одним запросом с оконной функцией ROW_NUMBER.
+    4) search - поиск по названию и описанию с сортировкой по релевантности.
+    В PostgreSQL - полнотекстовый поиск по search_vector и триграммы,
+    в остальных БД (например, SQLite в тестах) - поиск подстроки:
+    совпадение названия, начало названия, название, затем описание.
+    SQLite без учёта регистра сравнивает только латинские буквы.
+    5) feed - рецепты авторов, на которых подписан пользователь,
+    в порядке feed_pub_date, id. Обычно это один проход по индексу
+    ленты FeedEntry, рецепты популярных авторов добавляются из Recipe.
+    """
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredients'
+                )
+            )
+        )
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+                author_is_subscribed=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favourite.objects.filter(
+                user=user, recipes=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipes=OuterRef('pk')
+            )),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author')
+            )),
+        )
+
+    def latest_by_author(self, limit):
+        ranked = self.order_by().annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        ).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) AS ranked '
+            'WHERE ranked.row_number <= %s',
+            (*params, limit)
+        ))
+
+    def search(self, value):
+        if connection.vendor != 'postgresql':
+            return self.filter(
+                Q(name__icontains=value) | Q(text__icontains=value)
+            ).annotate(
+                rank=Case(
+                    When(name__iexact=value, then=Value(3.0)),
+                    When(name__istartswith=value, then=Value(2.0)),
+                    When(name__icontains=value, then=Value(1.0)),
+                    default=Value(0.0),
+                    output_field=models.FloatField(),
+                )
+            ).order_by('-rank', '-pub_date', '-id')
+        query = SearchQuery(value, config='russian', search_type='websearch')
+        return self.filter(
+            Q(search_vector=query)
+            | Q(name__icontains=value)
+            | Q(text__icontains=value)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query)
+            + TrigramSimilarity('name', value)
+        ).order_by('-rank', '-pub_date', '-id')
+
+    def feed(self, user):
+        popular_authors = Subscription.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).values('author')
+        if not popular_authors.exists():
+            return self.filter(feed_entries__user=user).annotate(
+                feed_pub_date=F('feed_entries__pub_date')
+            ).order_by('-feed_pub_date', '-id')
+        return self.filter(
+            Q(pk__in=FeedEntry.objects.filter(user=user).values('recipes'))
+            | Q(author__in=popular_authors)
+        ).annotate(
+            feed_pub_date=F('pub_date')
+        ).order_by('-feed_pub_date', '-id')
+
+
 class Recipe(models.Model):
     """Модель для рецептов."""
 
@@ -91,17 +210,53 @@ class Recipe(models.Model):
         'Дата и время публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата и время изменения',
+        auto_now=True
+    )
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
         default=1,
         validators=[MinValueValidator(1)]
     )
+    image_variants = models.JSONField(
+        'Варианты изображения',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipe'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-pub_date', '-id'),
+                name='recipe_favorites_count_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -142,6 +297,47 @@ class IngredientRecipe(models.Model):
         return self.ingredients.name
 
 
+class UserRecipeManager(models.Manager):
+    """
+    Менеджер избранного и списка покупок для пакетных запросов с 2 методами.
+    Строки пользователя блокируются, счётчик рецептов из counter_field
+    модели пересчитывается одним UPDATE на все рецепты:
+    1) add - добавляет рецепты одним INSERT, возвращает id добавленных.
+    2) remove - удаляет рецепты одним DELETE, возвращает id удалённых.
+    """
+
+    def lock(self, user, recipe_ids):
+        User.objects.select_for_update().filter(pk=user.pk).exists()
+        return set(self.filter(
+            user=user, recipes__in=recipe_ids
+        ).values_list('recipes', flat=True))
+
+    def update_counters(self, recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            **{self.model.counter_field: count_by(self.model, 'recipes')}
+        )
+
+    def add(self, user, recipe_ids):
+        with transaction.atomic():
+            existing = self.lock(user, recipe_ids)
+            added = [pk for pk in recipe_ids if pk not in existing]
+            self.bulk_create(
+                [self.model(user=user, recipes_id=pk) for pk in added],
+                ignore_conflicts=True
+            )
+            self.update_counters(added)
+        return added
+
+    def remove(self, user, recipe_ids):
+        with transaction.atomic():
+            existing = self.lock(user, recipe_ids)
+            removed = [pk for pk in recipe_ids if pk in existing]
+            with bulk_changes():
+                self.filter(user=user, recipes__in=removed).delete()
+            self.update_counters(removed)
+        return removed
+
+
 class ShoppingCart(models.Model):
     """Модель для списка покупок."""
 
@@ -156,6 +352,9 @@ class ShoppingCart(models.Model):
         verbose_name='Пользователь',
     )
 
+    counter_field = 'in_carts_count'
+    objects = UserRecipeManager()
+
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
@@ -171,6 +370,180 @@ class ShoppingCart(models.Model):
         return self.recipes.name
 
 
+class ShoppingCartIngredientManager(models.Manager):
+    """
+    Менеджер сводного списка покупок с методами:
+    1) add_recipes и remove_recipes - добавляют или вычитают
+    ингредиенты рецептов при изменении списка покупок пользователя.
+    2) change_recipe - переносит изменение ингредиентов рецепта
+    в списки покупок всех пользователей, у которых он есть.
+    3) rebuild - пересчитывает сводный список покупок с нуля.
+    4) inconsistencies - возвращает расхождения между сводным
+    списком и рецептами в списках покупок.
+    Первые два вызываются сигналами ShoppingCart и IngredientRecipe,
+    поэтому список остаётся верным при записи из админки и ORM.
+    Удаление рецепта вычитается через каскадное удаление этих строк.
+    """
+
+    def expected_totals(self, user_ids=None):
+        queryset = IngredientRecipe.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(recipes__shopping__user__in=user_ids)
+        return {
+            (row['user'], row['ingredients']): row['amount']
+            for row in queryset.values(
+                'ingredients', user=F('recipes__shopping__user')
+            ).annotate(
+                amount=Sum('amount')
+            ).exclude(user=None).order_by()
+        }
+
+    def apply(self, deltas):
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        user_ids = sorted({user_id for user_id, _ in deltas})
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids
+            ).order_by('pk').values_list('pk', flat=True))
+            existing = {
+                (row.user_id, row.ingredients_id): row
+                for row in self.filter(
+                    user__in=user_ids,
+                    ingredients__in={ingredient for _, ingredient in deltas}
+                )
+            }
+            changed, removed, created = [], [], []
+            for (user_id, ingredient_id), delta in deltas.items():
+                row = existing.get((user_id, ingredient_id))
+                if row is None:
+                    if delta > 0:
+                        created.append(self.model(
+                            user_id=user_id,
+                            ingredients_id=ingredient_id,
+                            amount=delta
+                        ))
+                    continue
+                row.amount += delta
+                if row.amount > 0:
+                    changed.append(row)
+                else:
+                    removed.append(row.pk)
+            self.bulk_update(changed, ['amount'])
+            self.filter(pk__in=removed).delete()
+            self.bulk_create(created)
+
+    def recipe_deltas(self, user_id, recipe_ids, sign):
+        return {
+            (user_id, row['ingredients']): sign * row['amount']
+            for row in IngredientRecipe.objects.filter(
+                recipes__in=recipe_ids
+            ).values('ingredients').annotate(
+                amount=Sum('amount')
+            ).order_by()
+        }
+
+    def add_recipes(self, user_id, recipe_ids):
+        self.apply(self.recipe_deltas(user_id, recipe_ids, 1))
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.apply(self.recipe_deltas(user_id, recipe_ids, -1))
+
+    def change_recipe(self, recipe_id, old_amounts, new_amounts):
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in {*old_amounts, *new_amounts}
+        }
+        changes = {key: delta for key, delta in changes.items() if delta}
+        if not changes:
+            return
+        self.apply({
+            (user_id, ingredient_id): delta
+            for user_id in ShoppingCart.objects.filter(
+                recipes=recipe_id
+            ).values_list('user', flat=True)
+            for ingredient_id, delta in changes.items()
+        })
+
+    def rebuild(self, user_ids=None):
+        with transaction.atomic():
+            queryset = self.all()
+            if user_ids is not None:
+                queryset = queryset.filter(user__in=user_ids)
+            queryset.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredients_id=ingredient_id,
+                        amount=amount
+                    )
+                    for (user_id, ingredient_id), amount
+                    in self.expected_totals(user_ids).items()
+                ),
+                batch_size=1000
+            )
+
+    def inconsistencies(self, user_ids=None):
+        expected = self.expected_totals(user_ids)
+        queryset = self.all()
+        if user_ids is not None:
+            queryset = queryset.filter(user__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in queryset.values_list(
+                'user', 'ingredients', 'amount'
+            )
+        }
+        return {
+            key: {
+                'expected': expected.get(key, 0),
+                'actual': actual.get(key, 0),
+            }
+            for key in {*expected, *actual}
+            if expected.get(key, 0) != actual.get(key, 0)
+        }
+
+
+class ShoppingCartIngredient(models.Model):
+    """
+    Сводный список покупок: общее количество каждого ингредиента
+    по всем рецептам из списка покупок пользователя.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+    )
+    ingredients = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField('Общее количество', default=0)
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент из списка покупок'
+        verbose_name_plural = 'Ингредиенты из списков покупок'
+        default_related_name = 'shopping_ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredients'],
+                name='unique_shopping_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return self.ingredients.name
+
+
 class Favourite(models.Model):
     """Модель для избранных рецептов."""
 
@@ -185,6 +558,9 @@ class Favourite(models.Model):
         verbose_name='Пользователь',
     )
 
+    counter_field = 'favorites_count'
+    objects = UserRecipeManager()
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
@@ -198,3 +574,136 @@ class Favourite(models.Model):
 
     def __str__(self):
         return self.recipes.name
+
+
+class FeedEntryManager(models.Manager):
+    """
+    Менеджер ленты подписок с 4 методами:
+    1) fan_out - раскладывает новый рецепт по лентам подписчиков автора
+    пачками по FEED_BATCH_SIZE. Рецепты популярных авторов (подписчиков
+    больше FEED_FANOUT_LIMIT) не раскладываются, их читает
+    RecipeQuerySet.feed.
+    2) subscribe - добавляет в ленту подписчика последние
+    FEED_BACKFILL_SIZE рецептов каждого из авторов.
+    3) backfill_followers - то же для всех подписчиков автора, когда он
+    перестаёт быть популярным.
+    4) unsubscribe - убирает рецепты авторов из ленты после отписки.
+    """
+
+    def fan_out(self, recipe):
+        if User.objects.filter(
+            pk=recipe.author_id,
+            followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).exists():
+            return
+        batch = []
+        for user_id in Subscription.objects.filter(
+            author=recipe.author_id
+        ).values_list('user', flat=True).iterator(
+            chunk_size=settings.FEED_BATCH_SIZE
+        ):
+            batch.append(self.model(
+                user_id=user_id,
+                recipes_id=recipe.id,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date
+            ))
+            if len(batch) >= settings.FEED_BATCH_SIZE:
+                self.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        self.bulk_create(batch, ignore_conflicts=True)
+
+    def create_entries(self, user_ids, recipes):
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipes_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date
+                )
+                for user_id in user_ids
+                for recipe_id, author_id, pub_date in recipes
+            ),
+            batch_size=settings.FEED_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+    def subscribe(self, user_id, author_ids):
+        recipes = list(Recipe.objects.filter(
+            author__in=author_ids
+        ).latest_by_author(settings.FEED_BACKFILL_SIZE).values_list(
+            'id', 'author', 'pub_date'
+        ).order_by())
+        self.create_entries([user_id], recipes)
+
+    def backfill_followers(self, author_id):
+        recipes = list(Recipe.objects.filter(author=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list(
+            'id', 'author', 'pub_date'
+        )[:settings.FEED_BACKFILL_SIZE])
+        followers = Subscription.objects.filter(
+            author=author_id
+        ).values_list('user', flat=True)
+        self.create_entries(list(followers), recipes)
+
+    def unsubscribe(self, user_id, author_ids):
+        self.filter(user=user_id, author__in=author_ids).delete()
+        # Авторы, которые перестали быть популярными: их новые рецепты
+        # снова раскладываются по лентам, а последние нужно разложить сейчас.
+        for author_id in User.objects.filter(
+            pk__in=author_ids, followers_count=settings.FEED_FANOUT_LIMIT
+        ).values_list('pk', flat=True):
+            self.backfill_followers(author_id)
+
+
+class FeedEntry(models.Model):
+    """
+    Лента подписок: рецепт автора в ленте подписчика. Дата публикации
+    скопирована из рецепта, чтобы страница ленты читалась по индексу
+    (user, pub_date, recipes) без сортировки.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+    )
+    recipes = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор рецепта',
+        related_name='+'
+    )
+    pub_date = models.DateTimeField('Дата и время публикации')
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        default_related_name = 'feed_entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipes'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipes'),
+                name='feed_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'), name='feed_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipes} в ленте {self.user}'
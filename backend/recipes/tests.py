@@ -0,0 +1,1015 @@
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from api.cache import response_cache
+from api.testing import (
+    create_recipe, create_user, create_users, png_base64
+)
+from recipes.images import VARIANTS
+from recipes.models import (
+    FeedEntry, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+    ShoppingCartIngredient, Tag
+)
+from users.models import Subscription
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class RecipeListQueriesTest(APITestCase):
+    """
+    Количество запросов к БД для списка рецептов
+    не зависит от размера страницы.
+    """
+
+    MAX_QUERIES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        authors = create_users(*(f'author{number}' for number in range(3)))
+        Subscription.objects.create(user=cls.user, author=authors[0])
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(5)
+        ]
+        for number in range(30):
+            recipe = create_recipe(
+                authors[number % len(authors)], name=f'Рецепт {number}'
+            )
+            recipe.tags.set(tags)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipes=recipe, ingredients=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients[:3]
+            )
+            if number % 2:
+                cls.user.favorited.create(recipes=recipe)
+            if number % 3:
+                cls.user.shopping.create(recipes=recipe)
+        cls.url = reverse('api:recipes-list')
+
+    def setUp(self):
+        response_cache().clear()
+
+    def test_anonymous_list_queries(self):
+        for limit in (6, 30):
+            response_cache().clear()
+            with self.assertNumQueries(self.MAX_QUERIES):
+                response = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_authenticated_list_queries(self):
+        self.client.force_authenticate(self.user)
+        for limit in (6, 30):
+            response_cache().clear()
+            with self.assertNumQueries(self.MAX_QUERIES):
+                response = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_cached_count(self):
+        self.client.force_authenticate(self.user)
+        params = {'limit': 6, 'author': self.user.subscriber.get().author_id}
+        with CaptureQueriesContext(connection) as first_queries:
+            first = self.client.get(self.url, params)
+        with CaptureQueriesContext(connection) as second_queries:
+            second = self.client.get(self.url, dict(params, page=2))
+        self.assertEqual(len(second_queries), len(first_queries) - 1)
+        self.assertEqual(first.data['count'], 10)
+        self.assertEqual(second.data['count'], 10)
+        self.assertTrue(second.data['count_exact'])
+
+    def test_authenticated_list_flags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {'limit': 30})
+        for item in response.data['results']:
+            recipe = Recipe.objects.get(pk=item['id'])
+            self.assertEqual(
+                item['is_favorited'],
+                self.user.favorited.filter(recipes=recipe).exists()
+            )
+            self.assertEqual(
+                item['is_in_shopping_cart'],
+                self.user.shopping.filter(recipes=recipe).exists()
+            )
+            self.assertEqual(
+                item['author']['is_subscribed'],
+                self.user.subscriber.filter(author=recipe.author).exists()
+            )
+            self.assertEqual(len(item['ingredients']), 3)
+            self.assertEqual(len(item['tags']), 2)
+
+    def test_cursor_pagination(self):
+        expected = list(
+            Recipe.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True
+            )
+        )
+        received = []
+        url, params = self.url, {'cursor': '', 'limit': 7}
+        while url:
+            with self.assertNumQueries(self.MAX_QUERIES - 1):
+                response = self.client.get(url, params)
+            self.assertNotIn('count', response.data)
+            received += [item['id'] for item in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(received, expected)
+
+    def test_cursor_with_ordering(self):
+        response = self.client.get(self.url, {
+            'cursor': '', 'limit': 30, 'ordering': '-favorites_count'
+        })
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            list(Recipe.objects.order_by(
+                '-favorites_count', '-pub_date', '-id'
+            ).values_list('id', flat=True))
+        )
+
+
+class RecipeSearchTest(APITestCase):
+    """Поиск рецептов по названию и описанию с сортировкой по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.recipes = {
+            name: create_recipe(author, name=name, text=text)
+            for name, text in (
+                ('Крем-Суп', 'Описание'),
+                ('Суп', 'Описание'),
+                ('Каша', 'Густая, как Суп'),
+                ('Суп-пюре', 'Описание'),
+                ('Tom Yum', 'Описание'),
+            )
+        }
+        cls.url = reverse('api:recipes-list')
+
+    def setUp(self):
+        response_cache().clear()
+
+    def search(self, value, **params):
+        response = self.client.get(
+            self.url, {'search': value, 'limit': 10, **params}
+        )
+        return response, [item['name'] for item in response.data['results']]
+
+    def test_ranking(self):
+        _, names = self.search('Суп')
+        self.assertEqual(names, ['Суп', 'Суп-пюре', 'Крем-Суп', 'Каша'])
+        # SQLite сравнивает без учёта регистра только латинские буквы.
+        _, names = self.search('TOM yum')
+        self.assertEqual(names, ['Tom Yum'])
+        _, names = self.search('Борщ')
+        self.assertEqual(names, [])
+
+    def test_empty_query(self):
+        response, names = self.search('')
+        self.assertEqual(response.data['count'], len(self.recipes))
+        self.assertEqual(names, list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('name', flat=True)))
+
+    def test_cursor_keeps_ranking(self):
+        response, names = self.search('Суп', cursor='')
+        self.assertEqual(names, ['Суп', 'Суп-пюре', 'Крем-Суп', 'Каша'])
+        self.assertEqual(response.data['count'], 4)
+
+
+class RecipeIngredientsValidationTest(APITestCase):
+    """Ошибки в ингредиентах рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author)
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.salt, cls.flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Мука')
+        )
+
+    def errors(self, ingredients):
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            reverse('api:recipes-detail', args=(self.recipe.id,)),
+            {
+                'tags': [self.tag.id], 'ingredients': ingredients,
+                'cooking_time': 5,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        return response.json()['ingredients']
+
+    def test_errors(self):
+        for ingredients, errors in (
+            ([], ['Нужно добавить ингредиенты!']),
+            (
+                [{'id': self.salt.id, 'amount': 1}, {'id': 10 ** 6}],
+                [{}, {
+                    'id': ['Ингредиента с id=1000000 не существует!'],
+                    'amount': ['Обязательное поле!'],
+                }],
+            ),
+            (
+                [
+                    {'id': self.salt.id, 'amount': 1},
+                    {'id': self.flour.id, 'amount': 2},
+                    {'id': self.salt.id, 'amount': 3},
+                ],
+                [{}, {}, {
+                    'id': [f'Ингредиент с id={self.salt.id} уже добавлен!']
+                }],
+            ),
+            ([{'id': self.salt.id}], [{'amount': ['Обязательное поле!']}]),
+            (
+                [{'id': self.salt.id, 'amount': 0}],
+                [{'amount': [
+                    'Убедитесь, что это значение больше либо равно 1.'
+                ]}],
+            ),
+            (
+                [{'id': self.salt.id, 'amount': -5}],
+                [{'amount': [
+                    'Убедитесь, что это значение больше либо равно 1.'
+                ]}],
+            ),
+        ):
+            self.assertEqual(self.errors(ingredients), errors, ingredients)
+
+    def test_all_errors_at_once(self):
+        ingredients = [
+            {'id': self.salt.id, 'amount': 1},
+            {'id': 10 ** 6, 'amount': 1},
+            {'id': self.flour.id, 'amount': 2},
+            {'id': 10 ** 6 + 1, 'amount': 1},
+            {'id': self.salt.id, 'amount': 3},
+            {'id': self.flour.id},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            errors = self.errors(ingredients)
+        self.assertEqual(
+            len([
+                query for query in queries
+                if 'FROM "recipes_ingredient"' in query['sql']
+            ]),
+            1
+        )
+        self.assertEqual(errors, [
+            {},
+            {'id': ['Ингредиента с id=1000000 не существует!']},
+            {},
+            {'id': ['Ингредиента с id=1000001 не существует!']},
+            {'id': [f'Ингредиент с id={self.salt.id} уже добавлен!']},
+            {
+                'id': [f'Ингредиент с id={self.flour.id} уже добавлен!'],
+                'amount': ['Обязательное поле!'],
+            },
+        ])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeWriteTest(APITestCase):
+    """Ингредиенты и теги рецепта при создании и изменении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def rows(self, recipe_id):
+        return dict(IngredientRecipe.objects.filter(
+            recipes=recipe_id
+        ).values_list('ingredients', 'amount'))
+
+    def tag_ids(self, recipe_id):
+        return set(Recipe.objects.get(pk=recipe_id).tags.values_list(
+            'id', flat=True
+        ))
+
+    def test_create(self):
+        salt, flour = self.ingredients[:2]
+        response = self.client.post(
+            reverse('api:recipes-list'),
+            {
+                'name': 'Хлеб', 'text': 'Описание', 'cooking_time': 60,
+                'image': png_base64(),
+                'tags': [self.tags[0].id, self.tags[1].id],
+                'ingredients': [
+                    {'id': salt.id, 'amount': 5},
+                    {'id': flour.id, 'amount': 500},
+                ],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        recipe_id = response.data['id']
+        self.assertEqual(self.rows(recipe_id), {salt.id: 5, flour.id: 500})
+        self.assertEqual(
+            self.tag_ids(recipe_id), {self.tags[0].id, self.tags[1].id}
+        )
+        self.assertEqual(
+            [item['amount'] for item in response.data['ingredients']],
+            [5, 500]
+        )
+
+    def test_update(self):
+        recipe = create_recipe(self.author)
+        recipe.tags.set(self.tags[:2])
+        kept, changed, removed, added = self.ingredients
+        for ingredient, amount in ((kept, 1), (changed, 2), (removed, 3)):
+            IngredientRecipe.objects.create(
+                recipes=recipe, ingredients=ingredient, amount=amount
+            )
+        row_ids = dict(recipe.ingredient_recipe.values_list(
+            'ingredients', 'id'
+        ))
+        response = self.client.patch(
+            reverse('api:recipes-detail', args=(recipe.id,)),
+            {
+                'tags': [self.tags[1].id, self.tags[2].id],
+                'ingredients': [
+                    {'id': kept.id, 'amount': 1},
+                    {'id': changed.id, 'amount': 20},
+                    {'id': added.id, 'amount': 4},
+                ],
+                'cooking_time': 5,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.rows(recipe.id), {kept.id: 1, changed.id: 20, added.id: 4}
+        )
+        for ingredient in (kept, changed):
+            self.assertTrue(IngredientRecipe.objects.filter(
+                pk=row_ids[ingredient.id], recipes=recipe
+            ).exists())
+        self.assertEqual(
+            self.tag_ids(recipe.id), {self.tags[1].id, self.tags[2].id}
+        )
+        self.assertEqual(
+            sorted(
+                (item['id'], item['amount'])
+                for item in response.data['ingredients']
+            ),
+            sorted([(kept.id, 1), (changed.id, 20), (added.id, 4)])
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANTS_SYNC=True)
+class ImageVariantsTest(APITestCase):
+    """Уменьшенные копии изображений рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def save_image(self, name):
+        path = os.path.join(MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (1000, 500), (200, 120, 40)).save(path, 'PNG')
+        return name
+
+    def media_path(self, name):
+        return os.path.join(MEDIA_ROOT, name)
+
+    def test_variants_created(self):
+        name = self.save_image('recipes/images/first/photo.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe(self.author, image=name, image_variants={})
+        recipe.refresh_from_db()
+        variants = recipe.image_variants
+        self.assertEqual(variants['original'], name)
+        self.assertEqual(
+            set(variants) - {'original'},
+            {variant for variant, *_ in VARIANTS}
+        )
+        with Image.open(self.media_path(variants['thumbnail'])) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (320, 160)))
+        with Image.open(self.media_path(variants['medium_webp'])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (800, 400)))
+
+    def test_same_file_names_do_not_collide(self):
+        names = [
+            self.save_image(f'recipes/images/{folder}/photo.png')
+            for folder in ('first', 'second')
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes = [
+                create_recipe(self.author, image=name, image_variants={})
+                for name in names
+            ]
+        first, second = [
+            Recipe.objects.get(pk=recipe.pk).image_variants
+            for recipe in recipes
+        ]
+        for variant, *_ in VARIANTS:
+            self.assertNotEqual(first[variant], second[variant])
+
+    def test_replaced_variants_deleted(self):
+        old_name = self.save_image('recipes/images/old.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe(
+                self.author, image=old_name, image_variants={}
+            )
+        recipe.refresh_from_db()
+        old_variants = recipe.image_variants
+        recipe.image = self.save_image('recipes/images/new.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        recipe.refresh_from_db()
+        for variant, *_ in VARIANTS:
+            self.assertFalse(
+                os.path.exists(self.media_path(old_variants[variant]))
+            )
+            self.assertTrue(
+                os.path.exists(self.media_path(recipe.image_variants[variant]))
+            )
+        self.assertTrue(os.path.exists(self.media_path(old_name)))
+
+    def test_generate_image_variants_command(self):
+        ready = create_recipe(self.author)
+        outdated = create_recipe(
+            self.author,
+            image=self.save_image('recipes/images/command.png'),
+            image_variants={}
+        )
+        missing = create_recipe(
+            self.author, image='recipes/images/missing.png',
+            image_variants={}
+        )
+        out, err = io.StringIO(), io.StringIO()
+        call_command(
+            'generate_image_variants', workers=1, stdout=out, stderr=err
+        )
+        self.assertIn(
+            'Обработано изображений: 1, с ошибками: 1.', out.getvalue()
+        )
+        self.assertIn(f'Рецепт {missing.id}', err.getvalue())
+        outdated.refresh_from_db()
+        self.assertEqual(
+            set(outdated.image_variants) - {'original'},
+            {variant for variant, *_ in VARIANTS}
+        )
+        ready.refresh_from_db()
+        self.assertEqual(
+            ready.image_variants, {'original': 'recipes/images/test.png'}
+        )
+
+
+class FeedTest(APITestCase):
+    """Лента подписок: раскладка новых рецептов, подписка и отписка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.other = create_users(
+            'reader', 'author', 'other'
+        )
+        cls.url = reverse('api:recipes-feed')
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_recipe(author)
+
+    def get_feed(self):
+        response = self.client.get(self.url, {'limit': 10})
+        return [item['id'] for item in response.data['results']]
+
+    def test_fan_out_and_subscription(self):
+        old = self.publish(self.author)
+        Subscription.objects.create(user=self.reader, author=self.author)
+        new = self.publish(self.author)
+        self.publish(self.other)
+        self.assertEqual(self.get_feed(), [new.id, old.id])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        Subscription.objects.filter(
+            user=self.reader, author=self.author
+        ).delete()
+        self.assertEqual(self.get_feed(), [])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_author(self):
+        Subscription.objects.create(user=self.reader, author=self.author)
+        recipe = self.publish(self.author)
+        self.assertFalse(FeedEntry.objects.filter(recipes=recipe).exists())
+        self.assertEqual(self.get_feed(), [recipe.id])
+
+
+class RecipeCountersTest(APITestCase):
+    """Счётчики избранного и покупок и сортировка по популярности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.recipes = [
+            create_recipe(cls.user, name=f'Рецепт {number}')
+            for number in range(3)
+        ]
+
+    def test_counters_and_ordering(self):
+        self.client.force_authenticate(self.user)
+        recipe = self.recipes[0]
+        for action in ('favorite', 'shopping-cart'):
+            url = reverse(f'api:recipes-{action}', args=(recipe.id,))
+            self.client.post(url)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+        response = self.client.get(
+            reverse('api:recipes-list'), {'ordering': '-favorites_count'}
+        )
+        self.assertEqual(response.data['results'][0]['id'], recipe.id)
+        self.assertEqual(response.data['results'][0]['favorites_count'], 1)
+        self.client.delete(reverse('api:recipes-favorite', args=(recipe.id,)))
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+    def test_batch_shopping_cart(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('api:recipes-shopping-cart-batch')
+        ids = [recipe.id for recipe in self.recipes[:2]]
+        response = self.client.post(
+            url, {'ids': [*ids, ids[0], 10 ** 6]}, format='json'
+        )
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['added', 'added', 'not_found']
+        )
+        self.assertEqual(
+            sorted(Recipe.objects.filter(pk__in=ids).values_list(
+                'in_carts_count', flat=True
+            )),
+            [1, 1]
+        )
+        response = self.client.delete(url, {'ids': ids}, format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['removed', 'removed']
+        )
+        self.assertFalse(self.user.shopping.exists())
+        self.assertFalse(self.user.shopping_ingredients.exists())
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=ids).values_list(
+                'in_carts_count', flat=True
+            )),
+            [0, 0]
+        )
+
+    def test_batch_counters_match_rows(self):
+        recipe = self.recipes[0]
+        create_user('other').favorited.create(recipes=recipe)
+        Recipe.objects.filter(pk=recipe.pk).update(favorites_count=5)
+        self.client.force_authenticate(self.user)
+        url = reverse('api:recipes-favorite-batch')
+        self.client.post(url, {'ids': [recipe.id]}, format='json')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 2)
+        self.client.delete(url, {'ids': [recipe.id]}, format='json')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+
+class ShoppingCartIngredientTest(APITestCase):
+    """
+    Сводный список покупок остаётся верным при любой записи:
+    через API, админку или ORM.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other = create_users('reader', 'other')
+        cls.salt, cls.flour, cls.milk = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Мука', 'Молоко')
+        )
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.bread, cls.pancakes = (
+            create_recipe(cls.other, name=name) for name in ('Хлеб', 'Блины')
+        )
+        for recipe, ingredient, amount in (
+            (cls.bread, cls.salt, 5),
+            (cls.bread, cls.flour, 500),
+            (cls.pancakes, cls.flour, 200),
+            (cls.pancakes, cls.milk, 300),
+        ):
+            IngredientRecipe.objects.create(
+                recipes=recipe, ingredients=ingredient, amount=amount
+            )
+
+    def totals(self, user=None):
+        self.assertEqual(ShoppingCartIngredient.objects.inconsistencies(), {})
+        return dict(ShoppingCartIngredient.objects.filter(
+            user=user or self.user
+        ).values_list('ingredients__name', 'amount'))
+
+    def test_cart_changes(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(
+            reverse('api:recipes-shopping-cart', args=(self.bread.id,))
+        )
+        ShoppingCart.objects.create(user=self.user, recipes=self.pancakes)
+        self.assertEqual(
+            self.totals(), {'Соль': 5, 'Мука': 700, 'Молоко': 300}
+        )
+        response = self.client.get(
+            reverse('api:recipes-download-shopping-cart'), {'format': 'csv'}
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            [
+                'name,amount,measurement_unit', 'Молоко,300,г',
+                'Мука,700,г', 'Соль,5,г',
+            ]
+        )
+        ShoppingCart.objects.filter(recipes=self.pancakes).delete()
+        self.assertEqual(self.totals(), {'Соль': 5, 'Мука': 500})
+        self.client.delete(
+            reverse('api:recipes-shopping-cart', args=(self.bread.id,))
+        )
+        self.assertEqual(self.totals(), {})
+
+    def test_ingredient_changes(self):
+        for user in (self.user, self.other):
+            ShoppingCart.objects.create(user=user, recipes=self.bread)
+        row = self.bread.ingredient_recipe.get(ingredients=self.flour)
+        row.amount = 400
+        row.save()
+        row.ingredients = self.milk
+        row.save()
+        IngredientRecipe.objects.create(
+            recipes=self.bread, ingredients=self.flour, amount=50
+        )
+        self.bread.ingredient_recipe.filter(ingredients=self.salt).delete()
+        for user in (self.user, self.other):
+            self.assertEqual(
+                self.totals(user), {'Молоко': 400, 'Мука': 50}
+            )
+
+    def test_recipe_update_and_delete(self):
+        ShoppingCart.objects.create(user=self.user, recipes=self.bread)
+        ShoppingCart.objects.create(user=self.user, recipes=self.pancakes)
+        self.client.force_authenticate(self.other)
+        response = self.client.patch(
+            reverse('api:recipes-detail', args=(self.bread.id,)),
+            {
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': self.flour.id, 'amount': 100},
+                    {'id': self.milk.id, 'amount': 10},
+                ],
+                'cooking_time': 5,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.totals(), {'Мука': 300, 'Молоко': 310})
+        self.client.delete(
+            reverse('api:recipes-detail', args=(self.bread.id,))
+        )
+        self.assertEqual(self.totals(), {'Мука': 200, 'Молоко': 300})
+        self.pancakes.delete()
+        self.assertEqual(self.totals(), {})
+
+    def test_check_and_rebuild(self):
+        ShoppingCart.objects.create(user=self.user, recipes=self.bread)
+        call_command('check_shopping_cart', stdout=io.StringIO())
+        ShoppingCartIngredient.objects.filter(
+            ingredients=self.salt
+        ).update(amount=1)
+        output = io.StringIO()
+        with self.assertRaisesMessage(CommandError, 'Найдено расхождений: 1'):
+            call_command('check_shopping_cart', stdout=output)
+        self.assertIn('ожидается 5, в таблице 1', output.getvalue())
+        call_command('rebuild_shopping_cart', stdout=io.StringIO())
+        self.assertEqual(self.totals(), {'Соль': 5, 'Мука': 500})
+
+
+class AnonymousCacheTest(APITestCase):
+    """Кэш ответов со списком и рецептом для неавторизованных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        cls.recipe = create_recipe(cls.author)
+        cls.recipe.tags.add(cls.tag)
+        IngredientRecipe.objects.create(
+            recipes=cls.recipe, ingredients=cls.ingredient, amount=5
+        )
+        cls.list_url = reverse('api:recipes-list')
+        cls.detail_url = reverse('api:recipes-detail', args=(cls.recipe.id,))
+
+    def setUp(self):
+        response_cache().clear()
+
+    def assertCache(self, url, state, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], state)
+        return response.data
+
+    def test_hit_and_miss(self):
+        # Для рецепта остаётся запрос времени изменения для ETag.
+        for url, queries in ((self.list_url, 0), (self.detail_url, 1)):
+            self.assertCache(url, 'MISS')
+            with self.assertNumQueries(queries):
+                self.assertCache(url, 'HIT')
+        self.assertCache(self.list_url, 'MISS', tags='tag')
+        self.assertCache(self.list_url, 'HIT', tags='tag', page=1)
+        self.client.force_authenticate(self.author)
+        self.assertNotIn('X-Cache', self.client.get(self.list_url))
+
+    def test_invalidation(self):
+        self.client.get(self.detail_url)
+
+        def change_recipe():
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+
+        def change_tag():
+            self.tag.name = 'Новый тег'
+            self.tag.save()
+
+        def change_ingredient():
+            self.ingredient.name = 'Перец'
+            self.ingredient.save()
+
+        def change_author():
+            self.author.first_name = 'Автор'
+            self.author.save()
+
+        for change, check in (
+            (change_recipe, lambda recipe: recipe['name']),
+            (change_tag, lambda recipe: recipe['tags'][0]['name']),
+            (change_ingredient, lambda recipe: recipe['ingredients'][0][
+                'name'
+            ]),
+            (change_author, lambda recipe: recipe['author']['first_name']),
+        ):
+            with self.subTest(change=change.__name__):
+                self.client.get(self.list_url)
+                self.assertCache(self.detail_url, 'HIT')
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                results = self.assertCache(self.list_url, 'MISS')['results']
+                recipe = self.assertCache(self.detail_url, 'MISS')
+                self.assertEqual(check(results[0]), check(recipe))
+                self.assertIn(
+                    check(recipe),
+                    ('Новое название', 'Новый тег', 'Перец', 'Автор')
+                )
+
+    def test_unrelated_user_changes(self):
+        self.assertCache(self.list_url, 'MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            reader = create_user('reader')
+            reader.first_name = 'Читатель'
+            reader.save()
+            self.author.set_password('new-pass')
+            self.author.save(update_fields=['password'])
+            self.author.save()
+        self.assertCache(self.list_url, 'HIT')
+
+
+class ConditionalGetTest(APITestCase):
+    """Ответы 304 на условные запросы рецептов, тегов и ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other = create_users('reader', 'other')
+        cls.recipe = create_recipe(cls.user)
+        Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        response_cache().clear()
+
+    def assertNotModified(self, url, queries=0, **headers):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_collections(self):
+        for name in ('recipes', 'tags', 'ingredients'):
+            url = reverse(f'api:{name}-list')
+            response = self.client.get(url)
+            self.assertNotModified(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertNotModified(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+        tag = Tag.objects.get()
+        url = reverse('api:tags-list')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = 'Новое имя'
+            tag.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_recipe(self):
+        url = reverse('api:recipes-detail', args=(self.recipe.id,))
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, queries=1, HTTP_IF_NONE_MATCH=etag)
+        self.client.force_authenticate(self.user)
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, queries=1, HTTP_IF_NONE_MATCH=etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.favorited.create(recipes=self.recipe)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['favorites_count'], 1)
+
+    def test_recipe_parts_changed_directly(self):
+        url = reverse('api:recipes-detail', args=(self.recipe.id,))
+        row = IngredientRecipe.objects.create(
+            recipes=self.recipe, ingredients=Ingredient.objects.get(),
+            amount=99
+        )
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            row.amount = 7
+            row.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ingredients'][0]['amount'], 7)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.tags.add(Tag.objects.get())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'][0]['slug'], 'tag')
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.get().recipe.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], [])
+
+    def test_user_flags(self):
+        self.client.force_authenticate(self.other)
+        url = reverse('api:recipes-list')
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+        self.client.post(
+            reverse('api:recipes-favorite-batch'),
+            {'ids': [self.recipe.id]}, format='json'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+
+
+@override_settings(RECIPE_FRAGMENT_CACHE=True)
+class RecipeFragmentCacheTest(APITestCase):
+    """Кэш общих частей рецептов и флаги пользователя поверх них."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = create_users('author', 'reader')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.recipe = create_recipe(cls.author)
+        cls.recipe.tags.add(cls.tag)
+        cls.url = reverse('api:recipes-list')
+
+    def setUp(self):
+        response_cache().clear()
+
+    def get_recipe(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url).data['results'][0]
+
+    def test_user_overlay(self):
+        self.reader.favorited.create(recipes=self.recipe)
+        Subscription.objects.create(user=self.reader, author=self.author)
+        self.assertFalse(self.get_recipe(self.author)['is_favorited'])
+        with self.assertNumQueries(1):
+            recipe = self.get_recipe(self.reader)
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(recipe['favorites_count'], 1)
+
+    def test_invalidation(self):
+        self.get_recipe(self.reader)
+        self.client.force_authenticate(self.author)
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        response = self.client.patch(
+            reverse('api:recipes-detail', args=(self.recipe.id,)),
+            {
+                'name': 'Новое название', 'tags': [self.tag.id],
+                'ingredients': [{'id': ingredient.id, 'amount': 5}],
+                'cooking_time': 5,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.get_recipe(self.reader)['name'], 'Новое название'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Новый тег'
+            self.tag.save()
+        self.assertEqual(
+            self.get_recipe(self.reader)['tags'][0]['name'], 'Новый тег'
+        )
+
+    def test_recipe_parts_changed_directly(self):
+        row = IngredientRecipe.objects.create(
+            recipes=self.recipe,
+            ingredients=Ingredient.objects.create(
+                name='Соль', measurement_unit='г'
+            ),
+            amount=99
+        )
+        self.assertEqual(
+            self.get_recipe(self.reader)['ingredients'][0]['amount'], 99
+        )
+        row.amount = 7
+        row.save()
+        self.assertEqual(
+            self.get_recipe(self.reader)['ingredients'][0]['amount'], 7
+        )
+        tag = Tag.objects.create(name='Второй', color='#000001', slug='two')
+        self.recipe.tags.add(tag)
+        self.assertEqual(
+            [item['slug'] for item in self.get_recipe(self.reader)['tags']],
+            ['tag', 'two']
+        )
+
+    def test_author_change(self):
+        other = create_recipe(create_user('other'), name='Другой')
+        self.client.force_authenticate(self.reader)
+        self.client.get(self.url)
+        # Без сигналов и смены updated_at: пока часть рецепта в кэше,
+        # новое название не видно.
+        Recipe.objects.filter(pk=other.pk).update(name='Без сброса')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Автор'
+            self.author.save()
+        recipes = {
+            recipe['id']: recipe
+            for recipe in self.client.get(self.url).data['results']
+        }
+        self.assertEqual(
+            recipes[self.recipe.id]['author']['first_name'], 'Автор'
+        )
+        self.assertEqual(recipes[other.id]['name'], 'Другой')
@@ -1,12 +1,50 @@
 from django.contrib import admin
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
+from recipes.admin import AuthorFilter, UserFilter
+from recipes.models import Recipe
 from users.models import Subscription, User
 
 
+@admin.register(User)
 class UserAdmin(admin.ModelAdmin):
 
-    list_filter = ('email', 'first_name')
+    list_display = (
+        'username',
+        'email',
+        'first_name',
+        'last_name',
+        'followers_count',
+        'recipes_count',
+    )
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('username', 'email', 'first_name', 'last_name')
+    show_full_result_count = False
 
+    def get_queryset(self, request):
+        # Подзапрос считается только для строк текущей страницы,
+        # в отличие от Count с GROUP BY по всей таблице.
+        return super().get_queryset(request).annotate(
+            recipes_count=Coalesce(Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('pk')
+                ).order_by().values('author').annotate(
+                    total=Count('pk')
+                ).values('total')
+            ), 0)
+        )
 
-admin.site.register(Subscription)
-admin.site.register(User, UserAdmin)
+    @admin.display(description='Рецептов')
+    def recipes_count(self, obj):
+        return obj.recipes_count
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(admin.ModelAdmin):
+
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    list_filter = (UserFilter, AuthorFilter)
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:48
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_followers_count(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Subscription = apps.get_model('users', 'Subscription')
+    followers = Subscription.objects.filter(
+        author=models.OuterRef('pk')
+    ).order_by().values('author').annotate(
+        total=models.Count('pk')
+    ).values('total')
+    User.objects.update(followers_count=Coalesce(
+        models.Subquery(followers), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_managers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_followers_count, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,68 @@
-from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models import UniqueConstraint
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db import models, transaction
+from django.db.models import (
+    Count, Exists, OuterRef, Subquery, UniqueConstraint, Value
+)
+from django.db.models.functions import Coalesce
+
+_bulk_changes = ContextVar('bulk_changes', default=False)
+
+
+@contextmanager
+def bulk_changes():
+    """
+    Внутри блока сигналы не обновляют счётчики, ленты, сводные списки
+    покупок и updated_at рецептов: код блока обновляет их сам
+    одним запросом на все строки.
+    """
+    token = _bulk_changes.set(True)
+    try:
+        yield
+    finally:
+        _bulk_changes.reset(token)
+
+
+def in_bulk_changes():
+    return _bulk_changes.get()
+
+
+def count_by(model, field):
+    """Подзапрос с количеством строк model, у которых field - этот объект."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class UserQuerySet(models.QuerySet):
+    """
+    Запросы для пользователей с 2 методами:
+    1) with_subscription - добавляет в запрос поле is_subscribed
+    для пользователя.
+    2) with_recipes_count - добавляет в запрос количество рецептов автора.
+    """
+
+    def with_subscription(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=models.BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('pk')
+            ))
+        )
+
+    def with_recipes_count(self):
+        return self.annotate(recipes_count=Count('recipe'))
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    """Менеджер пользователей с запросами из UserQuerySet."""
 
 
 class User(AbstractUser):
@@ -21,6 +83,13 @@ class User(AbstractUser):
     )
     first_name = models.CharField('Имя', max_length=150, db_index=True)
     last_name = models.CharField('Фамилия', max_length=150)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False
+    )
+
+    objects = CustomUserManager()
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -30,6 +99,49 @@ class User(AbstractUser):
         return self.username
 
 
+class SubscriptionManager(models.Manager):
+    """
+    Менеджер подписок для пакетных запросов с 2 методами. Строка
+    подписчика блокируется, followers_count авторов пересчитывается
+    одним UPDATE:
+    1) add - подписывает на авторов одним INSERT, возвращает id авторов,
+    на которых подписка добавлена.
+    2) remove - отписывает одним DELETE, возвращает id авторов,
+    от которых пользователь отписан.
+    """
+
+    def lock(self, user, author_ids):
+        User.objects.select_for_update().filter(pk=user.pk).exists()
+        return set(self.filter(
+            user=user, author__in=author_ids
+        ).values_list('author', flat=True))
+
+    def update_counters(self, author_ids):
+        User.objects.filter(pk__in=author_ids).update(
+            followers_count=count_by(self.model, 'author')
+        )
+
+    def add(self, user, author_ids):
+        with transaction.atomic():
+            existing = self.lock(user, author_ids)
+            added = [pk for pk in author_ids if pk not in existing]
+            self.bulk_create(
+                [self.model(user=user, author_id=pk) for pk in added],
+                ignore_conflicts=True
+            )
+            self.update_counters(added)
+        return added
+
+    def remove(self, user, author_ids):
+        with transaction.atomic():
+            existing = self.lock(user, author_ids)
+            removed = [pk for pk in author_ids if pk in existing]
+            with bulk_changes():
+                self.filter(user=user, author__in=removed).delete()
+            self.update_counters(removed)
+        return removed
+
+
 class Subscription(models.Model):
     """Модель подписки пользователя."""
 
@@ -46,6 +158,8 @@ class Subscription(models.Model):
         related_name='subscriber'
     )
 
+    objects = SubscriptionManager()
+
     class Meta:
 
         verbose_name = 'Подписка'
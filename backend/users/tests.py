@@ -0,0 +1,79 @@
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from api.testing import create_recipe, create_user
+from recipes.models import Recipe
+from users.models import Subscription
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    """
+    Количество запросов к БД для списка подписок
+    не зависит от количества авторов на странице.
+    """
+
+    MAX_QUERIES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        for number in range(10):
+            author = create_user(f'author{number}')
+            Subscription.objects.create(user=cls.user, author=author)
+            for recipe_number in range(number):
+                create_recipe(author, name=f'Рецепт {recipe_number}')
+        cls.url = reverse('api:users-subscriptions')
+
+    def test_subscriptions_queries(self):
+        self.client.force_authenticate(self.user)
+        for limit in (2, 10):
+            with self.assertNumQueries(self.MAX_QUERIES):
+                response = self.client.get(
+                    self.url, {'limit': limit, 'recipes_limit': 3}
+                )
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_subscriptions_order(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {'limit': 4, 'page': 2})
+        self.assertEqual(
+            [author['username'] for author in response.data['results']],
+            [f'author{number}' for number in range(5, 1, -1)]
+        )
+
+    def test_subscriptions_recipes_limit(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(
+            self.url, {'limit': 10, 'recipes_limit': 3}
+        )
+        for author in response.data['results']:
+            recipes = Recipe.objects.filter(author_id=author['id'])
+            self.assertEqual(author['recipes_count'], recipes.count())
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']],
+                list(recipes.order_by(
+                    '-pub_date', '-id'
+                ).values_list('id', flat=True)[:3])
+            )
+            self.assertTrue(author['is_subscribed'])
+
+    def test_batch_subscribe(self):
+        reader = create_user('batch')
+        self.client.force_authenticate(reader)
+        url = reverse('api:users-subscribe-batch')
+        ids = [self.user.id, reader.id]
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['added', 'self']
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 1)
+        response = self.client.delete(url, {'ids': ids}, format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['removed', 'self']
+        )
+        self.assertFalse(reader.subscriber.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 0)